@@ -1,81 +1,158 @@
-from flask import Flask, render_template, request, send_file, url_for, jsonify
-import qrcode
+from flask import Flask, render_template, request, send_file, url_for, jsonify, make_response, Response, session, redirect, g
+from flask import before_render_template, template_rendered
 from io import BytesIO
 import base64
+import hashlib
 import os
+import secrets
+import threading
+import time
 from datetime import datetime
-import zipfile
 from dotenv import load_dotenv
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import assets
+from hunt import HuntRegistry
+from leaderboard import LeaderboardFeed
+import metrics
+from page_cache import PageCache, page_response
+from progress import ProgressStore
+from qr_cache import QRCache, MIMETYPES
+from qr_export import EXPORT_FORMATS, stream_zip, build_pdf_sheet
+from ratelimit import RateLimiter
 
 app = Flask(__name__)
 
+# Proxies in front of the app that set X-Forwarded-For (Render has one). Without this every
+# player would share the proxy's address; set PROXY_HOPS=0 when clients connect directly,
+# or they could pick their own address.
+PROXY_HOPS = int(os.environ.get("PROXY_HOPS", 1))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
+# Edited templates are picked up without a restart (the page cache watches them too)
+app.jinja_env.auto_reload = True
+app.jinja_env.globals.update(asset_url=assets.asset_url, critical_css=assets.critical_css)
+
 load_dotenv()
 ADMIN_PASSWORD = os.environ.get("ADMIN_PASSWORD")
-FINAL_ANSWER = "69"
-
-# Directory where QR codes are stored
-QR_CODES_DIR = "qr_codes"  # Adjust the path as needed
-
-# Location data
-LOCATIONS = {
-    'A': {
-        'name': 'Starting Point - SAC',
-        'riddle': '''
-Once a spotlight for stars to shine,
-Last year, it fell out of line.
-But now it's ready, no longer away,
-Find your next clue where performers sway.
-        ''',
-        'password': 'start',
-        'next_location': 'B'
-    },
-    'B': {
-        'name': 'Stage Area',
-        'riddle': '''
-Where ideas ignite and dreams take flight,
-A hub of innovation, shining bright.
-From spark to startup, it's the place to align,
-Find your next clue where visions refine.
-        ''',
-        'password': 'sac',
-        'next_location': 'C'
-    },
-    'C': {
-        'name': 'OUTR FINE',
-        'riddle': '''
-Where wheels depart and friendships mend,
-Hostel hearts bid goodbye to day scholar friends.
-The journey begins, but bonds remain true,
-Find your next clue where partings ensue.
-        ''',
-        'password': 'stage area',
-        'next_location': 'D'
-    },
-    'D': {
-        'name': 'Bus Stand',
-        'riddle': '''
-The pioneers of tech, where minds ignite,
-Crafting robots and designs so bright.
-At the best of spots, where innovation thrives,
-Your next clue waits, where brilliance arrives.
-        ''',
-        'password': 'outr fine',
-        'next_location': 'E'
-    },
-    'E': {
-        'name': 'Zairza - Final Riddle - Don\'t Shout Come And Whisper In Our Ears!',
-        'riddle': '''
-A man of vision, wisdom, and grace,
-He led India’s growth, leaving a strong trace.
-His dream was simple, yet vast and true,
-A safe car for the middle class to pursue.
-A gem we lost, but his legacy remains,
-When did this great soul’s journey end its reign?
-        ''',
-        'password': 'bus stand',
-        'next_location': None
-    }
-}
+
+def load_secret_key(path=".secret_key"):
+    """Key for signing team session cookies; must be the same in every gunicorn worker"""
+    if os.environ.get("SECRET_KEY"):
+        return os.environ["SECRET_KEY"]
+    try:
+        # O_EXCL so only the first worker to start creates the key
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    except FileExistsError:
+        pass
+    with open(path) as f:
+        return f.read().strip()
+
+app.secret_key = load_secret_key()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    if metrics.profiler:
+        metrics.profiler.start(request.path)
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed responses (QR bundles, SSE) are timed up to their first byte
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.observe('hunt_request_duration_seconds', time.perf_counter() - g.request_start,
+                    route=route, method=request.method)
+    metrics.inc('hunt_requests_total', route=route, method=request.method, status=response.status_code)
+    return response
+
+@app.teardown_request
+def stop_profiler(exc):
+    if metrics.profiler:
+        metrics.profiler.stop()
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    g.render_start = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def record_render_time(sender, template, context, **extra):
+    metrics.observe('hunt_phase_duration_seconds', time.perf_counter() - g.render_start, phase='template_render')
+
+# Base URL encoded into the printed QR codes
+BASE_URL = "https://treasure-hunt-zairza.onrender.com/"
+
+# Rendered QR images, shared by the index page, the image route and the admin download
+qr_cache = QRCache()
+
+# Hunt definitions are compiled from hunts/ and reloaded when the files change
+hunts = HuntRegistry()
+HUNT_ID = os.environ.get("HUNT", "zairza")
+
+def current_hunt():
+    """The hunt these routes serve"""
+    return hunts[HUNT_ID]
+
+@app.before_request
+def reload_hunts():
+    hunts.reload_if_changed()
+
+# Rendered index and location pages, reused until the hunt, templates or CSS build change
+page_cache = PageCache(extra_files=[assets.MANIFEST])
+
+# Team progress, shared by every worker through an SQLite file
+progress = ProgressStore()
+
+def current_team():
+    """Id of the team in the signed session cookie, starting a new one if there isn't one.
+
+    Only called when a team acts (a correct answer, naming itself). The team is
+    stored with its first checkpoint, so visitors who only look at pages never
+    show up on the leaderboard.
+    """
+    team_id = session.get('team_id')
+    if team_id is None:
+        team_id = session['team_id'] = secrets.token_urlsafe(8)
+        session.permanent = True
+    return team_id
+
+def team_position(hunt):
+    """Index of the furthest location the current client has unlocked"""
+    team_id = session.get('team_id')
+    reached = progress.position(team_id, hunt.id) if team_id else -1
+    # Everyone starts with the first location unlocked
+    return max(reached, 0)
+
+# Limits on password and final answer guesses, shared by every worker
+rate_limiter = RateLimiter()
+
+# Final answer guesses share one budget, whichever route they come in through
+FINAL_ANSWER_KEY = 'final'
+
+def rate_limited(location_id):
+    """Seconds the current client must wait before guessing at location_id again, or 0"""
+    # Not current_team(): a script that drops its cookie would get a new team, and a
+    # full bucket, on every guess. Without a cookie only the address's bucket applies.
+    return rate_limiter.hit(location_id, session.get('team_id'), request.remote_addr)
+
+# Live standings for the served hunt, pushed to leaderboard screens over SSE
+leaderboard_feed = LeaderboardFeed(progress, HUNT_ID)
+
+# An SSE stream holds one of the worker's threads for as long as the screen is open,
+# so only a few are served per worker; other screens poll /leaderboard/standings.
+# Async mode (see asgi.py) serves streams off the event loop without this limit.
+LEADERBOARD_STREAMS = int(os.environ.get("LEADERBOARD_STREAMS", 1))
+stream_slots = threading.BoundedSemaphore(LEADERBOARD_STREAMS)
+LEADERBOARD_RETRY = 10
+
+@app.route('/team', methods=['POST'])
+def set_team_name():
+    name = request.form.get('name', '').strip()[:40]
+    if name:
+        progress.rename_team(current_team(), name)
+        session['team_name'] = name
+    return redirect(url_for('index'))
 
 @app.route("/admin", methods=["GET"])
 def admin():
@@ -88,86 +165,160 @@ def download_qr_codes():
     if password != ADMIN_PASSWORD:
         return "Unauthorized", 401
 
-    base_url = "https://treasure-hunt-zairza.onrender.com/"
-
-    # Create a BytesIO object to store the .zip file in memory
-    zip_buffer = BytesIO()
-
-    # Create a ZipFile object
-    with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-        for location_id in LOCATIONS:
-            url = f"{base_url}/location/{location_id}"
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_H,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(url)
-            qr.make(fit=True)
-            
-            qr_img = qr.make_image(fill_color="black", back_color="white")
-
-            # Save QR code to a temporary BytesIO object
-            img_buffer = BytesIO()
-            qr_img.save(img_buffer, format='PNG')
-            img_buffer.seek(0)
-
-            # Add the image to the zip file
-            zip_file.writestr(f"{location_id}.png", img_buffer.read())
-
-    # Ensure the buffer's pointer is at the beginning
-    zip_buffer.seek(0)
-
-    # Send the zip file to the client for download
-    return send_file(
-        zip_buffer,
+    # Export options, e.g. ?format=svg&size=20&locations=A,B
+    fmt = request.values.get('format', 'png').upper()
+    if fmt not in EXPORT_FORMATS:
+        return f"Unsupported format: {fmt.lower()}", 400
+
+    try:
+        box_size = int(request.values.get('size', 10))
+    except ValueError:
+        box_size = 0
+    if not 1 <= box_size <= 40:
+        return "Size must be between 1 and 40", 400
+
+    # Each location once, in the order asked for
+    location_ids = list(dict.fromkeys(l.strip() for l in request.values.get('locations', '').split(',') if l.strip()))
+    locations = current_hunt().locations
+    location_ids = location_ids or list(locations)
+    unknown = [l for l in location_ids if l not in locations]
+    if unknown:
+        return f"Unknown locations: {', '.join(unknown)}", 400
+
+    qr_cache.invalidate(qr_fingerprint())
+
+    if fmt == 'PDF':
+        # A printable sheet has to be laid out as a whole, so it isn't streamed
+        jobs = [(l, location_url(l), box_size, 'PNG') for l in location_ids]
+        labels = {l: f"{l} - {locations[l].name}" for l in location_ids}
+        return send_file(
+            BytesIO(build_pdf_sheet(jobs, labels, qr_cache)),
+            mimetype='application/pdf',
+            as_attachment=True,
+            download_name='qr_codes.pdf'
+        )
+
+    # Stream the archive entry by entry as the images are rendered
+    jobs = [(f"{l}.{fmt.lower()}", location_url(l), box_size, fmt) for l in location_ids]
+    return Response(
+        stream_zip(jobs, qr_cache),
         mimetype='application/zip',
-        as_attachment=True,
-        download_name='qr_codes.zip'
+        headers={'Content-Disposition': 'attachment; filename=qr_codes.zip'}
     )
 
+def location_url(location_id):
+    """URL a location's QR code points at"""
+    return f"{BASE_URL}/location/{location_id}"
+
+def qr_fingerprint():
+    """Changes whenever the base url or the set of locations changes"""
+    key = "\0".join([BASE_URL, *current_hunt().locations])
+    return hashlib.sha256(key.encode()).hexdigest()
+
 def generate_qr_codes():
-    """Generate all QR codes and save them to the system"""
-    base_url = "https://treasure-hunt-zairza.onrender.com/"
-    
-    if not os.path.exists('static/qr_codes'):
-        os.makedirs('static/qr_codes')
-    
-    for location_id in LOCATIONS:
-        url = f"{base_url}/location/{location_id}"
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(url)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
+    """Make sure every location's QR code is rendered and cached"""
+    qr_cache.invalidate(qr_fingerprint())
+    for location_id in current_hunt().locations:
+        qr_cache.get(location_url(location_id))
 
 def get_qr_code_data(location_id):
     """Get QR code as base64 string"""
-    with open(f'static/qr_codes/location_{location_id}.png', 'rb') as f:
-        return base64.b64encode(f.read()).decode()
+    data, _ = qr_cache.get(location_url(location_id))
+    return base64.b64encode(data).decode()
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Blocked guesses are already shared through the rate limiter's database
+    blocked = [
+        ('hunt_rate_limited_total', {'policy': policy, 'location': location_id}, count)
+        for (policy, location_id), count in rate_limiter.blocked_counts().items()
+    ]
+    return Response(metrics.registry.render(blocked), mimetype='text/plain; version=0.0.4')
+
+@app.route('/assets/<filename>')
+def asset(filename):
+    return assets.send_asset(filename)
+
+@app.route('/qr/<location_id>.<fmt>')
+def qr_image(location_id, fmt):
+    fmt = fmt.upper()
+    if location_id not in current_hunt().locations or fmt not in MIMETYPES:
+        return "QR code not found", 404
+
+    qr_cache.invalidate(qr_fingerprint())
+    data, etag = qr_cache.get(location_url(location_id), fmt=fmt)
+
+    response = make_response(data)
+    response.mimetype = MIMETYPES[fmt]
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 @app.route('/')
 def index():
-    # Generate QR codes when the application starts
+    # Cheap after the first request: only renders QR codes missing from the cache
     generate_qr_codes()
-    return render_template('index.html')
+    hunt = current_hunt()
+    if session.get('team_name'):
+        # The form shows the team's name, so this one can't be shared
+        return render_template('index.html', start=hunt.start)
+    return page_response(page_cache.get(('index',), hunt, lambda: render_template('index.html', start=hunt.start)))
+
+@app.route('/leaderboard')
+def leaderboard():
+    return render_template('leaderboard.html', hunt=current_hunt(), retry_seconds=LEADERBOARD_RETRY)
+
+@app.route('/leaderboard/standings')
+def leaderboard_standings():
+    return jsonify(leaderboard_feed.standings())
+
+@app.route('/leaderboard/stream')
+def leaderboard_stream():
+    if not stream_slots.acquire(blocking=False):
+        return Response(
+            f"retry: {LEADERBOARD_RETRY * 1000}\n\n",
+            503,
+            mimetype='text/event-stream',
+            headers={'Retry-After': str(LEADERBOARD_RETRY)}
+        )
+    response = Response(
+        leaderboard_feed.stream(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Runs when gunicorn closes the response, even if the stream never started
+    response.call_on_close(stream_slots.release)
+    return response
 
 @app.route('/submit_final_answer', methods=['POST'])
 def submit_final_answer():
+    hunt = current_hunt()
+    retry_after = rate_limited(FINAL_ANSWER_KEY)
+    if retry_after:
+        return jsonify({
+            'status': 'error',
+            'message': 'Too many attempts. Try again later!'
+        }), 429, {'Retry-After': str(int(retry_after) + 1)}
+
     answer = request.form.get('answer', '').strip()
-    if answer == FINAL_ANSWER:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    final = hunt.locations[hunt.order[-1]]
+    if team_position(hunt) < final.position:
+        return jsonify({
+            'status': 'error',
+            'message': 'Reach the final location first!'
+        })
+    if hunt.check_final(answer):
+        metrics.inc('hunt_answers_total', location='final', result='correct')
+        now = datetime.now()
+        progress.record_finish(current_team(), hunt.id, now.timestamp(), session.get('team_name'))
+        timestamp = now.strftime("%Y-%m-%d %H:%M:%S")
         return jsonify({
             'status': 'success',
             'message': 'Correct answer!',
             'timestamp': timestamp
         })
+    metrics.inc('hunt_answers_total', location='final', result='incorrect')
     return jsonify({
         'status': 'error',
         'message': 'Incorrect answer. Try again!'
@@ -175,47 +326,75 @@ def submit_final_answer():
 
 @app.route('/location/<location_id>', methods=['GET', 'POST'])
 def location(location_id):
-    if location_id not in LOCATIONS:
+    hunt = current_hunt()
+    location_data = hunt.get(location_id)
+    if location_data is None:
         return "Location not found", 404
 
-    location_data = LOCATIONS[location_id]
+    if request.method == 'GET':
+        # Guesses are counted separately, in hunt_answers_total
+        metrics.inc('hunt_location_views_total', location=location_id)
     error = None
-    unlocked = False
     completion_time = None
 
     # Check if this is the final location
-    is_final = location_id == 'F'
+    is_final = location_data.is_final
 
-    # First location is always unlocked
-    if location_id == 'A':
-        unlocked = True
+    position = team_position(hunt)
+    unlocked = position >= location_data.position
 
     # Handle POST requests
     if request.method == 'POST':
-        if is_final and 'final_answer' in request.form:
+        # Turn away guessing scripts before doing any real work
+        final_guess = is_final and 'final_answer' in request.form
+        retry_after = rate_limited(FINAL_ANSWER_KEY if final_guess else location_id)
+        if retry_after:
+            return "Too many attempts! Try again later.", 429, {'Retry-After': str(int(retry_after) + 1)}
+
+        if final_guess:
             # Handle final answer submission
             final_answer = request.form.get('final_answer', '').strip()
-            if final_answer == FINAL_ANSWER:
-                completion_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            if not unlocked:
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Reach the final location first!'
+                })
+            if hunt.check_final(final_answer):
+                metrics.inc('hunt_answers_total', location='final', result='correct')
+                now = datetime.now()
+                progress.record_finish(current_team(), hunt.id, now.timestamp(), session.get('team_name'))
+                completion_time = now.strftime("%Y-%m-%d %H:%M:%S")
                 return jsonify({
                     'status': 'success',
                     'message': 'Congratulations! You have completed the treasure hunt!',
                     'completion_time': completion_time
                 })
             else:
+                metrics.inc('hunt_answers_total', location='final', result='incorrect')
                 return jsonify({
                     'status': 'error',
                     'message': 'Incorrect answer. Try again!'
                 })
         else:
             # Handle regular password check
-            password = request.form.get('password', '').lower()
-            if password == location_data['password']:
+            password = request.form.get('password', '')
+            if position < location_data.position - 1:
+                # Locations have to be reached in order
+                previous_id = hunt.order[location_data.position - 1]
+                error = f"Solve location {previous_id} first!"
+                metrics.inc('hunt_answers_total', location=location_id, result='out_of_order')
+            elif location_data.check(password):
+                metrics.inc('hunt_answers_total', location=location_id, result='correct')
                 unlocked = True
+                progress.record_checkpoint(
+                    current_team(), hunt.id, location_id, location_data.position, session.get('team_name')
+                )
             else:
+                metrics.inc('hunt_answers_total', location=location_id, result='incorrect')
                 error = "Incorrect password! Try again."
 
-    return render_template(
+    # The page only depends on these, so each variant is rendered once
+    page = page_cache.get(('location', location_id, unlocked, error, is_final), hunt, lambda: render_template(
         'location.html',
         location_id=location_id,
         location=location_data,
@@ -223,7 +402,8 @@ def location(location_id):
         unlocked=unlocked,
         completion_time=completion_time,
         is_final=is_final  # Pass is_final to the template
-    )
+    ))
+    return page_response(page)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,186 @@
+"""Optional async serving mode.
+
+    SERVER_MODE=async gunicorn -c config.py asgi:application
+
+Every route still runs in the Flask app, on a thread pool, so the event loop
+never does QR encoding or template rendering. What changes is that a
+connection no longer owns a thread for its whole lifetime. Streamed bodies
+(the QR bundle download) are pulled from the app one chunk at a time, and
+leaderboard SSE clients are served straight from the event loop. Slow
+downloads and wall screens then don't use up the worker's request slots.
+"""
+import asyncio
+import os
+import queue
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from app import app, leaderboard_feed
+
+executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ASYNC_THREADS', 16)), thread_name_prefix='flask'
+)
+
+SSE_KEEPALIVE = 15.0
+
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI http scope (PEP 3333 strings are latin-1 decoded bytes)"""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin-1'),
+        'PATH_INFO': scope['path'].encode().decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        if name in environ:
+            # Repeated Cookie headers are one cookie list, everything else a comma list
+            value = f"{environ[name]}{'; ' if name == 'HTTP_COOKIE' else ','}{value}"
+        environ[name] = value
+    return environ
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def run_wsgi(scope, receive, send):
+    """Run the Flask app on the executor and stream its response back chunk by chunk"""
+    body = await read_body(receive)
+    if body is None:
+        return
+    loop = asyncio.get_running_loop()
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+
+    result = await loop.run_in_executor(executor, app, build_environ(scope, body), start_response)
+    chunks = iter(result)
+    disconnected = asyncio.ensure_future(receive())
+    try:
+        started = False
+        while True:
+            next_chunk = loop.run_in_executor(executor, next, chunks, None)
+            await asyncio.wait({next_chunk, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                # Stop pulling: closing the body (below) stops an abandoned download's rendering.
+                # The chunk in progress has to finish first, a running generator can't be closed.
+                await asyncio.wait({next_chunk})
+                return
+            chunk = next_chunk.result()
+            if not started:
+                await send({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+                started = True
+            if chunk is None:
+                break
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        disconnected.cancel()
+        if hasattr(result, 'close'):
+            await loop.run_in_executor(executor, result.close)
+
+
+class AsyncSubscriber:
+    """Leaderboard subscriber backed by an asyncio queue, fed from the poller thread"""
+
+    def __init__(self, loop, max_backlog):
+        self.loop = loop
+        self.max_backlog = max_backlog
+        self.messages = asyncio.Queue()
+
+    def put_nowait(self, message):
+        if self.messages.qsize() >= self.max_backlog:
+            raise queue.Full
+        self.loop.call_soon_threadsafe(self.messages.put_nowait, message)
+
+
+async def leaderboard_stream(receive, send):
+    if await read_body(receive) is None:
+        return
+    loop = asyncio.get_running_loop()
+    subscriber = AsyncSubscriber(loop, leaderboard_feed.max_backlog)
+    # The first subscriber in a worker catches the feed up from the database
+    await loop.run_in_executor(executor, leaderboard_feed.subscribe, subscriber)
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+        ],
+    })
+
+    disconnected = asyncio.ensure_future(receive())
+    try:
+        while True:
+            if not leaderboard_feed.is_subscribed(subscriber) and subscriber.messages.empty():
+                # Dropped for falling behind; the browser will reconnect
+                break
+            next_message = asyncio.ensure_future(subscriber.messages.get())
+            done, _ = await asyncio.wait(
+                {next_message, disconnected}, timeout=SSE_KEEPALIVE, return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnected in done:
+                next_message.cancel()
+                return
+            if next_message in done:
+                message = next_message.result()
+            else:
+                next_message.cancel()
+                message = ': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': message.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+    finally:
+        disconnected.cancel()
+        leaderboard_feed.unsubscribe(subscriber)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+    elif scope['type'] != 'http':
+        return
+    elif scope['method'] == 'GET' and scope['path'] == '/leaderboard/stream':
+        await leaderboard_stream(receive, send)
+    else:
+        await run_wsgi(scope, receive, send)
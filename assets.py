@@ -0,0 +1,227 @@
+"""Self-hosted CSS: purged against the templates, minified and content-hashed.
+
+Build with `python assets.py` after changing templates or the CSS source; the
+output in static/dist/ is committed so deploys don't need a build step.
+"""
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+
+from flask import request, send_from_directory, url_for
+from markupsafe import Markup
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_CSS = os.path.join(BASE_DIR, 'assets', 'tailwind.css')
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+DIST_DIR = os.path.join(BASE_DIR, 'static', 'dist')
+MANIFEST = os.path.join(DIST_DIR, 'manifest.json')
+
+CLASS_ATTRIBUTE = re.compile(r'''class\s*=\s*(["'])(.*?)\1''', re.S)
+JINJA_TAG = re.compile(r'{{.*?}}|{%.*?%}', re.S)
+SELECTOR_CLASS = re.compile(r'\.((?:\\.|[\w-])+)')
+COMMENT = re.compile(r'/\*(?!!).*?\*/', re.S)
+
+
+# Building
+
+def template_classes(path):
+    """Every class name used in a template's class attributes"""
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    classes = set()
+    for _, value in CLASS_ATTRIBUTE.findall(source):
+        classes.update(JINJA_TAG.sub(' ', value).split())
+    return classes
+
+
+def parse_css(css, pos=0):
+    """Parse css into ('comment', text), ('rule', selector, declarations) and ('at', prelude, children) nodes"""
+    nodes = []
+    while True:
+        while pos < len(css) and css[pos].isspace():
+            pos += 1
+        if pos >= len(css) or css[pos] == '}':
+            return nodes, pos + 1
+        if css.startswith('/*', pos):
+            end = css.index('*/', pos) + 2
+            nodes.append(('comment', css[pos:end]))
+            pos = end
+            continue
+        brace = css.index('{', pos)
+        prelude = css[pos:brace].strip()
+        if prelude.startswith('@'):
+            children, pos = parse_css(css, brace + 1)
+            nodes.append(('at', prelude, children))
+        else:
+            end = css.index('}', brace)
+            nodes.append(('rule', prelude, css[brace + 1:end]))
+            pos = end + 1
+
+
+def split_selectors(selector):
+    """Split a selector list on top-level commas"""
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(selector):
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(selector[start:i])
+            start = i + 1
+    parts.append(selector[start:])
+    return [part.strip() for part in parts]
+
+
+def purge(nodes, used, keep_comments=True):
+    """Drop rules whose selectors need a class that isn't in used"""
+    kept = []
+    for node in nodes:
+        if node[0] == 'comment':
+            if keep_comments and node[1].startswith('/*!'):
+                kept.append(node)
+        elif node[0] == 'at':
+            children = purge(node[2], used, keep_comments=False)
+            if any(child[0] != 'comment' for child in children):
+                kept.append(('at', node[1], children))
+        else:
+            selectors = [
+                s for s in split_selectors(node[1])
+                if all(re.sub(r'\\(.)', r'\1', c) in used for c in SELECTOR_CLASS.findall(s))
+            ]
+            if selectors:
+                kept.append(('rule', ', '.join(selectors), node[2]))
+    return kept
+
+
+def minify(nodes):
+    out = []
+    for node in nodes:
+        if node[0] == 'comment':
+            out.append(node[1] + '\n')
+        elif node[0] == 'at':
+            prelude = re.sub(r':\s+', ':', ' '.join(node[1].split()))
+            out.append(f"{prelude}{{{minify(node[2])}}}")
+        else:
+            selector = re.sub(r'\s*([>,~+])\s*', r'\1', ' '.join(node[1].split()))
+            declarations = []
+            for declaration in COMMENT.sub('', node[2]).split(';'):
+                if declaration.strip():
+                    prop, value = declaration.split(':', 1)
+                    value = re.sub(r',\s+', ',', ' '.join(value.split()))
+                    declarations.append(f"{prop.strip()}:{value}")
+            out.append(f"{selector}{{{';'.join(declarations)}}}")
+    return ''.join(out)
+
+
+def build(source=SOURCE_CSS, templates_dir=TEMPLATES_DIR, dist_dir=DIST_DIR):
+    """Write the purged bundle (plus compressed copies) and the manifest; returns the manifest"""
+    with open(source, encoding='utf-8') as f:
+        nodes, _ = parse_css(f.read())
+
+    per_template = {
+        os.path.basename(path): template_classes(path)
+        for path in sorted(glob.glob(os.path.join(templates_dir, '*.html')))
+    }
+    used = set().union(*per_template.values())
+
+    bundle = minify(purge(nodes, used)).encode()
+    name = f"app.{hashlib.sha256(bundle).hexdigest()[:12]}.css"
+
+    os.makedirs(dist_dir, exist_ok=True)
+    for old in glob.glob(os.path.join(dist_dir, 'app.*.css*')):
+        os.remove(old)
+    with open(os.path.join(dist_dir, name), 'wb') as f:
+        f.write(bundle)
+    encodings = ['gzip']
+    with open(os.path.join(dist_dir, name + '.gz'), 'wb') as f:
+        f.write(gzip.compress(bundle, 9, mtime=0))
+    if brotli is not None:
+        encodings.append('br')
+        with open(os.path.join(dist_dir, name + '.br'), 'wb') as f:
+            f.write(brotli.compress(bundle, quality=11))
+
+    manifest = {
+        'files': {'app.css': name},
+        'encodings': encodings,
+        # Just what each page needs, to inline so first paint doesn't wait on a stylesheet
+        'critical': {
+            template: minify(purge(nodes, classes, keep_comments=False))
+            for template, classes in per_template.items() if classes
+        },
+    }
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+# Serving
+
+def load_manifest(path=MANIFEST):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+manifest = {'files': {}, 'encodings': [], 'critical': {}}
+_manifest_mtime = None
+
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+
+def current_manifest():
+    """The manifest, reloaded when a rebuild rewrites it so running workers pick up new CSS"""
+    global manifest, _manifest_mtime
+    try:
+        mtime = os.stat(MANIFEST).st_mtime_ns
+        if mtime != _manifest_mtime:
+            manifest = load_manifest()
+            _manifest_mtime = mtime
+    except (OSError, ValueError):
+        # Missing, or caught half-written by a build; keep what we had
+        pass
+    return manifest
+
+
+def asset_url(name):
+    """URL of the current content-hashed build of asset `name`, e.g. 'app.css'"""
+    return url_for('asset', filename=current_manifest()['files'][name])
+
+
+def critical_css(template_name):
+    return Markup(current_manifest()['critical'].get(template_name, ''))
+
+
+def send_asset(filename):
+    """Send a built asset, precompressed if the client accepts it, cached forever"""
+    built = current_manifest()
+    if filename not in built['files'].values():
+        return "Asset not found", 404
+
+    accepted = request.accept_encodings
+    encoding = next((e for e in ('br', 'gzip') if e in built['encodings'] and accepted[e]), None)
+    # The name changes with the content, so a fetched copy never goes stale
+    response = send_from_directory(
+        DIST_DIR, filename + ENCODING_SUFFIXES.get(encoding, ''), mimetype='text/css', max_age=31536000
+    )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the purged, content-hashed CSS bundle")
+    parser.add_argument('--source', default=SOURCE_CSS, help="CSS to purge, e.g. the full tailwind.min.css")
+    args = parser.parse_args()
+    built = build(args.source)
+    print(f"Wrote {built['files']['app.css']} ({', '.join(built['encodings'])})")
@@ -0,0 +1,393 @@
+"""Local benchmarks for the treasure hunt app.
+
+Usage: python bench.py <benchmark> [options]
+"""
+import argparse
+import gzip
+import http.cookiejar
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import qrcode
+
+from leaderboard import Leaderboard, LeaderboardFeed
+from metrics import Registry, SlowRequestProfiler
+from progress import ProgressStore
+from qr_export import stream_zip
+from ratelimit import RateLimiter
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__.replace('_', '-')] = func
+    return func
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def serial_zip(urls):
+    """The original /admin/download path: render one after another into an in-memory ZIP"""
+    zip_buffer = BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
+        for i, url in enumerate(urls):
+            qr = qrcode.QRCode(
+                version=1,
+                error_correction=qrcode.constants.ERROR_CORRECT_H,
+                box_size=10,
+                border=4,
+            )
+            qr.add_data(url)
+            qr.make(fit=True)
+            img_buffer = BytesIO()
+            qr.make_image(fill_color="black", back_color="white").save(img_buffer, format='PNG')
+            zip_file.writestr(f"{i}.png", img_buffer.getvalue())
+    return zip_buffer.getvalue()
+
+
+def streamed_zip(urls):
+    """The export engine, without the cache so every image is really rendered"""
+    jobs = [(f"{i}.png", url, 10, 'PNG') for i, url in enumerate(urls)]
+    size = 0
+    largest_chunk = 0
+    for chunk in stream_zip(jobs):
+        size += len(chunk)
+        largest_chunk = max(largest_chunk, len(chunk))
+    return size, largest_chunk
+
+
+def import_app(tmp):
+    """The hunt app, with its databases in tmp"""
+    # The app picks its database paths up at import time
+    os.environ['PROGRESS_DB'] = os.path.join(tmp, 'progress.db')
+    os.environ['RATE_LIMIT_DB'] = os.path.join(tmp, 'ratelimit.db')
+    import app as hunt_app
+    return hunt_app
+
+
+@benchmark
+def export(args):
+    """Serial in-memory ZIP vs the parallel streaming export"""
+    urls = [f"https://treasure-hunt-zairza.onrender.com//location/L{i:04d}" for i in range(args.locations)]
+
+    serial_time, archive = timed(serial_zip, urls)
+    streamed_time, (streamed_size, largest_chunk) = timed(streamed_zip, urls)
+
+    print(f"locations:  {args.locations}")
+    print(f"serial:     {serial_time:.2f}s, {len(archive)} bytes held in memory")
+    print(f"streamed:   {streamed_time:.2f}s, {streamed_size} bytes, largest chunk {largest_chunk} bytes")
+    print(f"speed-up:   {serial_time / streamed_time:.2f}x")
+
+
+@benchmark
+def leaderboard(args):
+    """Ranking updates and SSE fan-out to many simulated subscribers"""
+    rng = random.Random(0)
+    teams = [f"team-{i}" for i in range(args.teams)]
+
+    board = Leaderboard()
+    positions = dict.fromkeys(teams, -1)
+    start = time.perf_counter()
+    for i in range(args.events):
+        team = rng.choice(teams)
+        positions[team] += 1
+        board.checkpoint(team, str(positions[team]), positions[team], float(i))
+    per_event = (time.perf_counter() - start) / args.events
+    print(f"ranking:     {args.events} events over {args.teams} teams, {per_event * 1e6:.1f}us per event")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # A long poll interval so only the explicit polls below run
+        store = ProgressStore(os.path.join(tmp, 'progress.db'))
+        feed = LeaderboardFeed(store, 'bench', poll_interval=3600)
+        flusher = ThreadPoolExecutor(1)
+        subscribers = [feed.subscribe() for _ in range(args.subscribers)]
+        for subscriber in subscribers:
+            subscriber.get_nowait()
+
+        positions = dict.fromkeys(teams, -1)
+        poll_times, deliver_times = [], []
+        for _ in range(args.rounds):
+            events = []
+            for _ in range(args.events_per_round):
+                team = rng.choice(teams)
+                positions[team] += 1
+                events.append((team, 'bench', str(positions[team]), positions[team]))
+            # Commit from another connection, as request threads do
+            flusher.submit(lambda: [store.record_checkpoint(*event) for event in events]).result()
+
+            start = time.perf_counter()
+            feed.poll()
+            poll_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for subscriber in subscribers:
+                subscriber.get_nowait()
+            deliver_times.append(time.perf_counter() - start)
+
+        poll_times.sort()
+        print(f"subscribers: {args.subscribers}, {args.events_per_round} events per poll")
+        print(f"poll+fan-out: p50 {poll_times[len(poll_times) // 2] * 1e3:.2f}ms, max {poll_times[-1] * 1e3:.2f}ms")
+        print(f"drain:        {sum(deliver_times) / len(deliver_times) * 1e3:.2f}ms per round for all subscribers")
+
+
+@benchmark
+def ratelimit(args):
+    """Cost of the rate limiter on legitimate guesses"""
+    with tempfile.TemporaryDirectory() as tmp:
+        limiter = RateLimiter(os.path.join(tmp, 'ratelimit.db'))
+        samples = []
+        for i in range(args.requests):
+            start = time.perf_counter()
+            limiter.hit('B', f"team-{i % args.teams}", f"10.0.{i % 250}.1")
+            samples.append(time.perf_counter() - start)
+        print(f"hit():          p50 {percentile(samples, 50) * 1e6:.0f}us, p99 {percentile(samples, 99) * 1e6:.0f}us")
+
+        hunt_app = import_app(tmp)
+
+        for enabled in (False, True):
+            hunt_app.rate_limiter.enabled = enabled
+            samples = []
+            for i in range(args.requests // 10):
+                client = hunt_app.app.test_client()
+                start = time.perf_counter()
+                client.post('/location/B', data={'password': 'wrong'})
+                samples.append(time.perf_counter() - start)
+            label = 'with limiter' if enabled else 'no limiter'
+            print(f"POST {label + ':':14} p50 {percentile(samples, 50) * 1e3:.2f}ms, p99 {percentile(samples, 99) * 1e3:.2f}ms")
+
+
+@benchmark
+def page_weight(args):
+    """Bytes and requests needed to show each page, through the test client"""
+    with tempfile.TemporaryDirectory() as tmp:
+        client = import_app(tmp).app.test_client()
+        for encoding in ('identity', 'gzip'):
+            headers = {'Accept-Encoding': encoding}
+            print(f"{encoding}:")
+            for path in ('/', '/location/A', '/leaderboard'):
+                page = client.get(path, headers=headers)
+                html = page.get_data()
+                text = gzip.decompress(html).decode() if page.content_encoding == 'gzip' else html.decode()
+                inline = sum(len(css) for css in re.findall(r'<style>(.*?)</style>', text, re.S))
+                stylesheets = re.findall(r'<link href="([^"]+)" rel="stylesheet">', text)
+                css_bytes = sum(len(client.get(href, headers=headers).get_data()) for href in stylesheets)
+                print(f"  {path:14} html {len(html):6} bytes (inline css {inline:5}), "
+                      f"{len(stylesheets)} stylesheet(s) {css_bytes:6} bytes, total {len(html) + css_bytes:6}")
+
+
+@benchmark
+def metrics(args):
+    """Overhead of the metrics and the slow-request profiler"""
+    with tempfile.TemporaryDirectory() as tmp:
+        registry = Registry(os.path.join(tmp, 'metrics'))
+        start = time.perf_counter()
+        for i in range(args.requests):
+            registry.observe('bench_seconds', 0.003, route='/location/<location_id>', method='GET')
+        per_observe = (time.perf_counter() - start) / args.requests
+        start = time.perf_counter()
+        for i in range(args.requests):
+            registry.inc('bench_total', route='/location/<location_id>', method='GET', status=200)
+        per_inc = (time.perf_counter() - start) / args.requests
+        print(f"observe(): {per_observe * 1e6:.2f}us, inc(): {per_inc * 1e6:.2f}us")
+
+        hunt_app = import_app(tmp)
+        client = hunt_app.app.test_client()
+        client.get('/location/A')
+        configurations = [
+            ('metrics off', False, None),
+            ('metrics on', True, None),
+            # A threshold nothing reaches, so this is the cost of sampling alone
+            ('+ profiler', True, SlowRequestProfiler(60000, directory=os.path.join(tmp, 'profiles'))),
+        ]
+        for label, enabled, profiler in configurations:
+            hunt_app.metrics.registry.enabled = enabled
+            hunt_app.metrics.profiler = profiler
+            samples = []
+            for _ in range(args.requests // 10):
+                start = time.perf_counter()
+                client.get('/location/A')
+                samples.append(time.perf_counter() - start)
+            print(f"GET /location/A {label + ':':13} p50 {percentile(samples, 50) * 1e3:.3f}ms, "
+                  f"p99 {percentile(samples, 99) * 1e3:.3f}ms")
+
+
+SERVER_MODES = {
+    'sync': ['app:app'],
+    'async': ['asgi:application'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, tmp, workers):
+    """gunicorn with config.py in the given mode, with its own databases in tmp"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        SERVER_MODE=mode,
+        ADMIN_PASSWORD='bench',
+        SECRET_KEY='bench',
+        # Measure serving, not the limiter turning the load generator away
+        RATE_LIMIT='off',
+        PROGRESS_DB=os.path.join(tmp, f'{mode}-progress.db'),
+        RATE_LIMIT_DB=os.path.join(tmp, f'{mode}-ratelimit.db'),
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'config.py', '-b', f'127.0.0.1:{port}', '-w', str(workers),
+         *SERVER_MODES[mode]],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(base + '/', timeout=1).read()
+            return server, base
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"{mode} server didn't start")
+
+
+class LoadRun:
+    """Replays hunt traffic against a running server and collects latencies per request kind"""
+
+    def __init__(self, base, duration, hunt):
+        self.base = base
+        self.deadline = time.monotonic() + duration
+        self.hunt = hunt
+        self.samples = {}
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def request(self, opener, kind, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        start = time.perf_counter()
+        try:
+            with opener.open(self.base + path, body, timeout=30) as response:
+                response.read()
+        except (urllib.error.URLError, OSError):
+            with self._lock:
+                self.errors += 1
+            return
+        with self._lock:
+            self.samples.setdefault(kind, []).append(time.perf_counter() - start)
+
+    def team(self):
+        """Teams scan the first QR code together, then work through the hunt and submit"""
+        order = self.hunt['order']
+        locations = self.hunt['locations']
+        while time.monotonic() < self.deadline:
+            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+            self.request(opener, 'scan', f'/location/{order[0]}')
+            for location_id in order[1:]:
+                if time.monotonic() >= self.deadline:
+                    return
+                self.request(opener, 'scan', f'/location/{location_id}')
+                self.request(opener, 'password', f'/location/{location_id}',
+                             {'password': locations[location_id]['password']})
+            self.request(opener, 'final', f'/location/{order[-1]}', {'final_answer': self.hunt['final_answer']})
+
+    def admin(self):
+        opener = urllib.request.build_opener()
+        while time.monotonic() < self.deadline:
+            self.request(opener, 'download', '/admin/download', {'password': 'bench'})
+
+    def watcher(self):
+        """A leaderboard screen: holds one connection open for the whole run"""
+        try:
+            with urllib.request.urlopen(self.base + '/leaderboard/stream', timeout=5) as stream:
+                while time.monotonic() < self.deadline:
+                    try:
+                        stream.readline()
+                    except socket.timeout:
+                        pass
+        except (urllib.error.URLError, OSError):
+            with self._lock:
+                self.errors += 1
+
+
+@benchmark
+def load(args):
+    """Realistic hunt traffic against gunicorn in sync and async mode: p50/p99 and throughput"""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hunts', 'zairza.json')) as f:
+        hunt = json.load(f)
+    hunt.setdefault('start', next(iter(hunt['locations'])))
+    order = [hunt['start']]
+    while hunt['locations'][order[-1]].get('next_location'):
+        order.append(hunt['locations'][order[-1]]['next_location'])
+    hunt['order'] = order
+
+    for mode in args.modes.split(','):
+        with tempfile.TemporaryDirectory() as tmp:
+            server, base = start_server(mode, tmp, args.workers)
+            try:
+                run = LoadRun(base, args.duration, hunt)
+                threads = [threading.Thread(target=run.watcher) for _ in range(args.watchers)]
+                threads += [threading.Thread(target=run.admin) for _ in range(args.admins)]
+                threads += [threading.Thread(target=run.team) for _ in range(args.users)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            finally:
+                server.terminate()
+                server.wait()
+
+        total = sum(len(samples) for samples in run.samples.values())
+        print(f"{mode}: {args.users} teams, {args.admins} admins, {args.watchers} leaderboard screens, "
+              f"{args.workers} worker(s), {args.duration}s")
+        for kind, samples in sorted(run.samples.items()):
+            print(f"  {kind:9} {len(samples):6} requests  p50 {percentile(samples, 50) * 1e3:7.1f}ms"
+                  f"  p99 {percentile(samples, 99) * 1e3:7.1f}ms")
+        print(f"  throughput {total / args.duration:.0f} req/s, {run.errors} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--locations', type=int, default=300, help="number of QR codes to export")
+    parser.add_argument('--teams', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--subscribers', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--events-per-round', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--modes', default='sync,async', help="server modes to compare in the load benchmark")
+    parser.add_argument('--users', type=int, default=32, help="concurrent teams in the load benchmark")
+    parser.add_argument('--admins', type=int, default=2)
+    parser.add_argument('--watchers', type=int, default=8, help="leaderboard screens held open")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=15)
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
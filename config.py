@@ -1,4 +1,16 @@
+import os
+
 bind = "0.0.0.0:10000"
 workers = 4
 threads = 4
-timeout = 120
\ No newline at end of file
+timeout = 120
+
+# SERVER_MODE=async: serve asgi:application on uvicorn workers (see asgi.py)
+if os.environ.get("SERVER_MODE") == "async":
+    worker_class = "uvicorn.workers.UvicornWorker"
+    wsgi_app = "asgi:application"
+
+def on_starting(server):
+    # Metrics snapshots from a previous run would otherwise be counted again
+    import metrics
+    metrics.clear_directory()
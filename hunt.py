@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+from types import MappingProxyType
+
+from markupsafe import Markup, escape
+
+try:
+    import yaml
+except ImportError:  # YAML hunt files are optional
+    yaml = None
+
+logger = logging.getLogger(__name__)
+
+HUNTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hunts')
+HUNT_EXTENSIONS = ('.json', '.yaml', '.yml')
+
+# Punctuation that separates words in an answer (as do whitespace and dashes)
+WORD_SEPARATORS = frozenset('/\\_,;:&+')
+
+
+def normalize_answer(answer):
+    """Fold an answer down to what matters: words of letters and digits separated by single spaces.
+
+    Case, accents and compatibility forms (full-width digits etc.) are ignored.
+    Whitespace, dashes, slashes and the like separate words; any other
+    punctuation is dropped, so "Bus-Stand!" matches "bus stand", "S.A.C."
+    matches "sac" and "O'Neil" matches "oneil".
+    """
+    folded = unicodedata.normalize('NFKD', answer).casefold()
+    chars = []
+    for char in folded:
+        if char.isalnum():
+            chars.append(char)
+        elif char.isspace() or char in WORD_SEPARATORS or unicodedata.category(char) == 'Pd':
+            chars.append(' ')
+    return ' '.join(''.join(chars).split())
+
+
+def render_riddle(riddle):
+    """Riddle text as HTML, keeping its line breaks"""
+    return Markup('<br>\n').join(escape(line.strip()) for line in riddle.strip().splitlines())
+
+
+class _Frozen:
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+
+class Location(_Frozen):
+    """One checkpoint of a compiled hunt"""
+
+    __slots__ = ('id', 'name', 'riddle', 'riddle_html', 'answers', 'next_location', 'position', 'is_final')
+
+    def __init__(self, location_id, data, position, is_final):
+        set_ = object.__setattr__
+        set_(self, 'id', location_id)
+        set_(self, 'name', data['name'])
+        set_(self, 'riddle', data['riddle'])
+        set_(self, 'riddle_html', render_riddle(data['riddle']))
+        set_(self, 'answers', frozenset(
+            normalize_answer(a) for a in [data['password'], *data.get('aliases', [])]
+        ))
+        set_(self, 'next_location', data.get('next_location'))
+        set_(self, 'position', position)
+        set_(self, 'is_final', is_final)
+
+    def check(self, answer):
+        """Whether answer is this location's password (or one of its aliases)"""
+        return normalize_answer(answer) in self.answers
+
+
+class Hunt(_Frozen):
+    """A hunt definition compiled for fast lookups; never modified after loading"""
+
+    __slots__ = ('id', 'title', 'start', 'locations', 'order', 'final_answers')
+
+    def __init__(self, data):
+        set_ = object.__setattr__
+        raw_locations = data['locations']
+        start = data.get('start') or next(iter(raw_locations))
+
+        # Walk the next_location chain once so positions and the final stop are known up front
+        order = []
+        location_id = start
+        while location_id is not None:
+            if location_id not in raw_locations:
+                raise ValueError(f"Hunt {data['id']!r}: unknown location {location_id!r}")
+            if location_id in order:
+                raise ValueError(f"Hunt {data['id']!r}: location {location_id!r} is visited twice")
+            order.append(location_id)
+            location_id = raw_locations[location_id].get('next_location')
+
+        unreachable = set(raw_locations) - set(order)
+        if unreachable:
+            raise ValueError(f"Hunt {data['id']!r}: unreachable locations {sorted(unreachable)}")
+
+        set_(self, 'id', data['id'])
+        set_(self, 'title', data.get('title', data['id']))
+        set_(self, 'start', start)
+        set_(self, 'order', tuple(order))
+        set_(self, 'locations', MappingProxyType({
+            location_id: Location(location_id, raw_locations[location_id], position, position == len(order) - 1)
+            for position, location_id in enumerate(order)
+        }))
+        set_(self, 'final_answers', frozenset(
+            normalize_answer(a) for a in [data['final_answer'], *data.get('final_aliases', [])]
+        ))
+
+    def get(self, location_id):
+        return self.locations.get(location_id)
+
+    def check_final(self, answer):
+        return normalize_answer(answer) in self.final_answers
+
+
+def load_hunt_file(path):
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.json'):
+            data = json.load(f)
+        elif yaml is None:
+            raise ValueError(f"{path}: install PyYAML to load YAML hunts")
+        else:
+            try:
+                data = yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise ValueError(f"{path}: {e}") from e
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: a hunt must be a mapping, not {type(data).__name__}")
+    data.setdefault('id', os.path.splitext(os.path.basename(path))[0])
+    return Hunt(data)
+
+
+class HuntRegistry:
+    """All hunts in a directory, recompiled and swapped in whenever a file changes.
+
+    Each gunicorn worker checks the files' mtimes at most once per
+    `check_interval` seconds. A reload compiles every hunt first and only then
+    replaces the mapping, so requests see either the old hunts or the new ones.
+    A hunt file that fails to compile is logged and the previous hunts are kept.
+    """
+
+    def __init__(self, directory=HUNTS_DIR, check_interval=2.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self._hunts = MappingProxyType({})
+        self._signature = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _current_signature(self):
+        signature = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(HUNT_EXTENSIONS):
+                stat = os.stat(os.path.join(self.directory, name))
+                signature.append((name, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def reload(self, signature=None):
+        signature = signature or self._current_signature()
+        hunts = {}
+        for name, _, _ in signature:
+            hunt = load_hunt_file(os.path.join(self.directory, name))
+            if hunt.id in hunts:
+                raise ValueError(f"Duplicate hunt id {hunt.id!r} in {name}")
+            hunts[hunt.id] = hunt
+        self._hunts = MappingProxyType(hunts)
+        self._signature = signature
+
+    def reload_if_changed(self):
+        now = time.monotonic()
+        if now < self._next_check or not self._lock.acquire(blocking=False):
+            return
+        try:
+            self._next_check = now + self.check_interval
+            signature = self._current_signature()
+            if signature != self._signature:
+                try:
+                    self.reload(signature)
+                    logger.info("Reloaded hunts: %s", ', '.join(self._hunts))
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    # Don't retry the same broken files until they change again
+                    self._signature = signature
+                    logger.error("Keeping previous hunts, reload failed: %s", e)
+        except OSError as e:
+            logger.error("Could not check hunt files: %s", e)
+        finally:
+            self._lock.release()
+
+    def __getitem__(self, hunt_id):
+        return self._hunts[hunt_id]
+
+    def __contains__(self, hunt_id):
+        return hunt_id in self._hunts
+
+    def __iter__(self):
+        return iter(self._hunts)
@@ -0,0 +1,285 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        # How many places following next[i] moves forward (to one past the end for None)
+        self.width = [1] * levels
+
+
+class RankedSkipList:
+    """Sorted, unique keys in an indexable skip list.
+
+    Insert, remove and rank are O(log n) expected, with no shifting of a
+    backing array, so one team moving costs the same with ten teams or ten
+    thousand.
+    """
+
+    MAX_LEVELS = 24
+
+    def __init__(self, seed=None):
+        self._head = _Node(None, self.MAX_LEVELS)
+        self._random = random.Random(seed)
+        self._size = 0
+        # Levels above this one have no nodes yet, so searches skip them
+        self._levels = 1
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        node = self._head.next[0]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+    def _search(self, key):
+        """The last node before key on each level, and its position (the head is 0)"""
+        chain = [self._head] * self.MAX_LEVELS
+        positions = [0] * self.MAX_LEVELS
+        node, position = self._head, 0
+        for level in reversed(range(self._levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def insert(self, key):
+        chain, positions = self._search(key)
+        levels = 1
+        while levels < self.MAX_LEVELS and self._random.random() < 0.5:
+            levels += 1
+        for level in range(self._levels, levels):
+            self._head.width[level] = self._size + 1
+        self._levels = max(self._levels, levels)
+        node = _Node(key, levels)
+        position = positions[0] + 1
+        for level in range(levels):
+            before = chain[level]
+            node.next[level] = before.next[level]
+            node.width[level] = before.width[level] - (position - positions[level]) + 1
+            before.next[level] = node
+            before.width[level] = position - positions[level]
+        for level in range(levels, self._levels):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain, _ = self._search(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for level in range(len(node.next)):
+            before = chain[level]
+            before.width[level] += node.width[level] - 1
+            before.next[level] = node.next[level]
+        for level in range(len(node.next), self._levels):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def rank(self, key):
+        """1-based position key has (or would have) in the sorted order"""
+        _, positions = self._search(key)
+        return positions[0] + 1
+
+
+class Leaderboard:
+    """Teams ranked by finish time, then furthest checkpoint, then when they reached it.
+
+    Kept sorted at all times in a skip list: an event moves one team, and
+    nothing is ever re-sorted from scratch.
+    """
+
+    def __init__(self):
+        self._ranking = RankedSkipList()
+        self._keys = {}
+        self.teams = {}
+
+    @staticmethod
+    def sort_key(team):
+        if team['finished_at'] is not None:
+            return (0, team['finished_at'], team['id'])
+        return (1, -team['position'], team['reached_at'], team['id'])
+
+    def _update(self, team_id, **changes):
+        team = self.teams.get(team_id)
+        if team is None:
+            team = self.teams[team_id] = {
+                'id': team_id, 'name': team_id, 'location': None,
+                'position': -1, 'reached_at': 0.0, 'finished_at': None,
+            }
+        else:
+            self._ranking.remove(self._keys[team_id])
+        team.update(changes)
+        key = self._keys[team_id] = self.sort_key(team)
+        self._ranking.insert(key)
+        return dict(team, rank=self.rank(team_id))
+
+    def rank(self, team_id):
+        return self._ranking.rank(self._keys[team_id])
+
+    def checkpoint(self, team_id, location_id, position, reached_at):
+        """Returns the team's updated row, or None if it was already further along"""
+        team = self.teams.get(team_id)
+        if team is not None and team['position'] >= position:
+            return None
+        return self._update(team_id, location=location_id, position=position, reached_at=reached_at)
+
+    def finish(self, team_id, finished_at):
+        return self._update(team_id, finished_at=finished_at)
+
+    def rename(self, team_id, name):
+        team = self.teams.get(team_id)
+        if team is None or team['name'] == name:
+            return None
+        team['name'] = name
+        return dict(team, rank=self.rank(team_id))
+
+    def standings(self):
+        return [dict(self.teams[key[-1]], rank=rank) for rank, key in enumerate(self._ranking, 1)]
+
+
+class LeaderboardFeed:
+    """Keeps a Leaderboard in step with the progress store and pushes changes to subscribers.
+
+    One poller thread per gunicorn worker reads new events from the store, so
+    the database sees one query per tick no matter how many screens are
+    watching. Each batch of changes is serialised once and the same bytes are
+    handed to every subscriber. A subscriber that stops reading is dropped;
+    its browser reconnects and starts again from a snapshot.
+    """
+
+    def __init__(self, store, hunt_id, poll_interval=0.5, max_backlog=100):
+        self.store = store
+        self.hunt_id = hunt_id
+        self.poll_interval = poll_interval
+        self.max_backlog = max_backlog
+        self.leaderboard = Leaderboard()
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._checkpoint_rowid = 0
+        self._finish_rowid = 0
+        self._rename_rowid = 0
+        self._data_version = None
+        self._poller_pid = None
+
+    def _start_poller(self):
+        with self._lock:
+            if self._poller_pid == os.getpid():
+                return
+            self._poller_pid = os.getpid()
+        # Catch up synchronously so the first subscriber gets a complete snapshot
+        self.poll()
+        threading.Thread(target=self._run_poller, name='leaderboard-poller', daemon=True).start()
+
+    def _run_poller(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.poll()
+            except Exception:
+                logger.exception("Leaderboard poll failed")
+
+    def poll(self):
+        """Apply events committed since the last poll and broadcast what changed"""
+        version = self.store.data_version()
+        if version == self._data_version:
+            return
+        self._data_version = version
+
+        checkpoints, finishes, renames = self.store.events_since(
+            self.hunt_id, self._checkpoint_rowid, self._finish_rowid, self._rename_rowid
+        )
+        # Teams seen for the first time get their current name; later renames arrive as events
+        teams = self.leaderboard.teams
+        new_teams = {row[1] for row in (*checkpoints, *finishes) if row[1] not in teams}
+        names = self.store.team_names(new_teams) if new_teams else {}
+
+        changes = {}
+        with self._lock:
+            for rowid, team_id, name in renames:
+                self._rename_rowid = rowid
+                row = self.leaderboard.rename(team_id, name)
+                if row:
+                    changes[team_id] = row
+            for rowid, team_id, location_id, position, reached_at in checkpoints:
+                self._checkpoint_rowid = rowid
+                row = self.leaderboard.checkpoint(team_id, location_id, position, reached_at)
+                if row:
+                    changes[team_id] = row
+            for rowid, team_id, finished_at in finishes:
+                self._finish_rowid = rowid
+                changes[team_id] = self.leaderboard.finish(team_id, finished_at)
+            for team_id, name in names.items():
+                row = self.leaderboard.rename(team_id, name)
+                if row:
+                    changes[team_id] = row
+            if changes:
+                self.publish('delta', list(changes.values()))
+
+    def publish(self, event, data):
+        """Serialise once, queue the same message for every subscriber"""
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                self._subscribers.discard(subscriber)
+
+    def subscribe(self, subscriber=None):
+        """Register a queue for SSE messages, starting with a snapshot of the standings.
+
+        Any object with a queue.Queue-style put_nowait() that raises
+        queue.Full when it's backed up will do; by default a new bounded Queue.
+        """
+        if self._poller_pid != os.getpid():
+            self._start_poller()
+        if subscriber is None:
+            subscriber = queue.Queue(self.max_backlog)
+        with self._lock:
+            # Under the lock so no delta can be queued ahead of the snapshot
+            subscriber.put_nowait(f"event: snapshot\ndata: {json.dumps(self.leaderboard.standings())}\n\n")
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def is_subscribed(self, subscriber):
+        return subscriber in self._subscribers
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def stream(self, keepalive=15.0):
+        """Generator of SSE messages for one client, for use as a streaming response body"""
+        subscriber = self.subscribe()
+        try:
+            while True:
+                if subscriber not in self._subscribers and subscriber.empty():
+                    # Dropped for falling behind; the browser will reconnect
+                    return
+                try:
+                    yield subscriber.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def standings(self):
+        if self._poller_pid != os.getpid():
+            self._start_poller()
+        with self._lock:
+            return self.leaderboard.standings()
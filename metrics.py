@@ -0,0 +1,253 @@
+"""Prometheus metrics aggregated across gunicorn workers, and a slow-request profiler.
+
+Each process keeps its metrics in memory and a background thread snapshots
+them to METRICS_DIR/<pid>.json about once a second. /metrics merges every
+snapshot, so the numbers cover all workers (and the QR export pool). The
+files of exited workers are kept so counters never go backwards; gunicorn
+clears the directory on startup (see config.py).
+"""
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, 'metrics_data'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'hunt_requests_total': ('counter', "Requests by route, method and status"),
+    'hunt_request_duration_seconds': ('histogram', "Time to produce a response, by route and method"),
+    'hunt_phase_duration_seconds': ('histogram', "Time spent in expensive phases of a request"),
+    'hunt_location_views_total': ('counter', "Location page requests, by location"),
+    'hunt_answers_total': ('counter', "Answer attempts by location and result"),
+}
+
+
+def clear_directory(directory=METRICS_DIR):
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+
+
+class Registry:
+    """Counters and histograms for one process, snapshotted to a shared directory"""
+
+    def __init__(self, directory=METRICS_DIR, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.enabled = os.environ.get('METRICS', 'on') != 'off'
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._writer_pid = None
+
+    def _start_writer(self):
+        # Started from the first observation so each forked worker gets its own
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer_pid = os.getpid()
+            # Anything inherited through fork is already in the parent's snapshot
+            self._counters.clear()
+            self._histograms.clear()
+        threading.Thread(target=self._run_writer, name='metrics-writer', daemon=True).start()
+
+    def _run_writer(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.dump()
+            except OSError:
+                pass
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        if self._writer_pid != os.getpid():
+            self._start_writer()
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        if self._writer_pid != os.getpid():
+            self._start_writer()
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0]
+            histogram[0][bucket] += 1
+            histogram[1] += seconds
+
+    @contextmanager
+    def timed(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, labels, list(counts), total]
+                               for (name, labels), (counts, total) in self._histograms.items()],
+            }
+
+    def dump(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self._snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        """Counters and histograms summed over every process's latest snapshot"""
+        snapshots = [self._snapshot()]
+        own = os.path.join(self.directory, f'{os.getpid()}.json')
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+        counters, histograms = {}, {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, counts, total in snapshot['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, [[0] * len(counts), 0.0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+        return counters, histograms
+
+    def render(self, extra_counters=()):
+        """The Prometheus text exposition of every metric, plus (name, labels, value) extras"""
+        counters, histograms = self.collect()
+        for name, labels, value in extra_counters:
+            counters[(name, tuple(sorted(labels.items())))] = value
+
+        lines = []
+        seen = set()
+
+        def header(name):
+            if name not in seen:
+                seen.add(name)
+                kind, help_text = METRICS.get(name, ('counter', ''))
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name)
+            lines.append(f'{name}{format_labels(labels)} {value}')
+        for (name, labels), (counts, total) in sorted(histograms.items()):
+            header(name)
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels((*labels, ("le", str(bound))))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels
+    )
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+registry = Registry()
+inc = registry.inc
+observe = registry.observe
+timed = registry.timed
+
+
+def phase(name):
+    """Time one phase of a request, e.g. `with metrics.phase('qr_encode'):`"""
+    return registry.timed('hunt_phase_duration_seconds', phase=name)
+
+
+class SlowRequestProfiler:
+    """Samples the stacks of in-flight requests and writes them out when a request is slow.
+
+    Opt-in with PROFILE_SLOW_MS. One sampler thread per process looks at
+    every request thread every `interval` seconds. Requests that take longer
+    than the threshold leave a collapsed-stack file in PROFILE_DIR, ready for
+    flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, threshold_ms, interval=0.005, directory=PROFILE_DIR):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self.directory = directory
+        self._active = {}
+        self._sampler_pid = None
+        self._lock = threading.Lock()
+
+    def _start_sampler(self):
+        with self._lock:
+            if self._sampler_pid == os.getpid():
+                return
+            self._sampler_pid = os.getpid()
+        threading.Thread(target=self._run_sampler, name='profiler', daemon=True).start()
+
+    def _run_sampler(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, (_, _, stacks) in list(self._active.items()):
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                if stack:
+                    stacks[';'.join(reversed(stack))] += 1
+
+    def start(self, label):
+        if self._sampler_pid != os.getpid():
+            self._start_sampler()
+        self._active[threading.get_ident()] = (label, time.perf_counter(), Counter())
+
+    def stop(self):
+        entry = self._active.pop(threading.get_ident(), None)
+        if entry is None:
+            return
+        label, started, stacks = entry
+        elapsed = time.perf_counter() - started
+        if elapsed < self.threshold or not stacks:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        safe_label = ''.join(c if c.isalnum() else '_' for c in label).strip('_') or 'root'
+        path = os.path.join(self.directory, f'{time.strftime("%Y%m%d-%H%M%S")}-{int(elapsed * 1000)}ms-{safe_label}.folded')
+        with open(path, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+profiler = SlowRequestProfiler(float(os.environ['PROFILE_SLOW_MS'])) if os.environ.get('PROFILE_SLOW_MS') else None
@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import make_response, request
+from werkzeug.http import http_date
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+class Page:
+    """One rendered page variant, stored ready to send in every encoding"""
+
+    __slots__ = ('body', 'encoded', 'etag', 'last_modified')
+
+    def __init__(self, html):
+        self.body = html.encode()
+        self.encoded = {'gzip': gzip.compress(self.body, 9)}
+        if brotli is not None:
+            self.encoded['br'] = brotli.compress(self.body, quality=11)
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self.last_modified = time.time()
+
+
+class PageCache:
+    """Pages rendered once per variant and reused until the hunt or templates change.
+
+    `key` must capture everything the page depends on. The cache is emptied
+    whenever `version` (the compiled hunt) is a different object than last
+    time, or a file in the templates directory or one of `extra_files` (e.g.
+    the CSS manifest) changes. The Jinja environment must have auto_reload
+    on, or the re-render would reuse the stale compiled template.
+    """
+
+    def __init__(self, templates_dir=TEMPLATES_DIR, extra_files=(), max_entries=512, check_interval=2.0):
+        self.templates_dir = templates_dir
+        self.extra_files = tuple(extra_files)
+        self.max_entries = max_entries
+        self.check_interval = check_interval
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._templates_signature = self._current_templates_signature()
+        self._next_check = 0.0
+
+    def _current_templates_signature(self):
+        signature = [
+            (entry.name, entry.stat().st_mtime_ns)
+            for entry in sorted(os.scandir(self.templates_dir), key=lambda e: e.name)
+        ]
+        for path in self.extra_files:
+            try:
+                signature.append((path, os.stat(path).st_mtime_ns))
+            except OSError:
+                signature.append((path, None))
+        return tuple(signature)
+
+    def _check(self, version):
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            signature = self._current_templates_signature()
+            if signature != self._templates_signature:
+                self._templates_signature = signature
+                self._version = None
+        if version is not self._version:
+            self._pages.clear()
+            self._version = version
+
+    def get(self, key, version, render):
+        """The cached Page for key, calling render() for its HTML on a miss"""
+        with self._lock:
+            self._check(version)
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                return page
+
+        page = Page(render())
+        with self._lock:
+            if version is self._version:
+                self._pages[key] = page
+                while len(self._pages) > self.max_entries:
+                    self._pages.popitem(last=False)
+        return page
+
+
+def page_response(page, status=200):
+    """Response for a cached page in the best encoding the client accepts"""
+    accepted = request.accept_encodings
+    for encoding in ('br', 'gzip'):
+        if encoding in page.encoded and accepted[encoding]:
+            response = make_response(page.encoded[encoding], status)
+            response.headers['Content-Encoding'] = encoding
+            response.set_etag(f"{page.etag}-{encoding}")
+            break
+    else:
+        response = make_response(page.body, status)
+        response.set_etag(page.etag)
+
+    response.mimetype = 'text/html'
+    response.vary.add('Accept-Encoding')
+    response.headers['Last-Modified'] = http_date(page.last_modified)
+    # Which variant a client gets depends on its session, so only revalidate privately
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    if status == 200:
+        return response.make_conditional(request)
+    return response
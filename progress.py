@@ -0,0 +1,219 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_DB = os.environ.get(
+    'PROGRESS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'progress.db')
+)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS teams (
+    team_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    team_id TEXT NOT NULL,
+    hunt_id TEXT NOT NULL,
+    location_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    reached_at REAL NOT NULL,
+    PRIMARY KEY (team_id, hunt_id, location_id)
+);
+CREATE TABLE IF NOT EXISTS renames (
+    team_id TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS finishes (
+    team_id TEXT NOT NULL,
+    hunt_id TEXT NOT NULL,
+    finished_at REAL NOT NULL,
+    PRIMARY KEY (team_id, hunt_id)
+);
+'''
+
+
+def default_team_name(team_id):
+    return f"Team {team_id[:4]}"
+
+
+class ProgressStore:
+    """Which team reached which checkpoint and when, shared by every gunicorn worker.
+
+    Backed by SQLite in WAL mode so readers never block the writer. Renames
+    only append to an in-memory queue; a background thread writes the queue
+    out in one transaction every `flush_interval` seconds. Checkpoints and
+    finishes are committed straight away: they gate the next location, and
+    the team's next request may land on another worker. There is at most one
+    per team and location, so this costs little. A team's row is created in
+    the same transaction as its first checkpoint, so every team on the
+    leaderboard has a name and nobody who only looked at a page is stored.
+    """
+
+    def __init__(self, path=PROGRESS_DB, flush_interval=0.05):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._queue = deque()
+        self._local = threading.local()
+        self._writer = None
+        self._writer_pid = None
+        self._writer_lock = threading.Lock()
+        self._version_db = None
+        self._version_pid = None
+        self._version_lock = threading.Lock()
+        db = self._connect()
+        db.executescript(SCHEMA)
+        db.close()
+        atexit.register(self.flush)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    @property
+    def _db(self):
+        # One connection per thread; sqlite connections aren't safe to share
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = self._local.db = self._connect()
+            self._local.pid = os.getpid()
+        return db
+
+    def _enqueue(self, sql, params):
+        self._queue.append((sql, params))
+        if self._writer_pid != os.getpid():
+            self._start_writer()
+
+    def _start_writer(self):
+        # gunicorn forks after the app is imported, so every worker starts its own writer
+        with self._writer_lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer_pid = os.getpid()
+            self._writer = threading.Thread(target=self._run_writer, name='progress-writer', daemon=True)
+            self._writer.start()
+
+    def _run_writer(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                logger.error("Failed to write progress: %s", e)
+                time.sleep(self.flush_interval)
+
+    def flush(self):
+        """Write every queued event in a single transaction"""
+        batch = []
+        while self._queue:
+            batch.append(self._queue.popleft())
+        if not batch:
+            return
+        db = self._db
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            for sql, params in batch:
+                db.execute(sql, params)
+            db.execute('COMMIT')
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            self._queue.extendleft(reversed(batch))
+            raise
+
+    def rename_team(self, team_id, name):
+        """Set a team's name, logging the change so the leaderboard picks it up as an event"""
+        self._enqueue(
+            'INSERT INTO teams (team_id, name, created_at) VALUES (?, ?, ?) '
+            'ON CONFLICT(team_id) DO UPDATE SET name = excluded.name',
+            (team_id, name, time.time()),
+        )
+        self._enqueue('INSERT INTO renames (team_id, name) VALUES (?, ?)', (team_id, name))
+
+    def position(self, team_id, hunt_id):
+        """Index of the furthest checkpoint the team has reached, or -1"""
+        row = self._db.execute(
+            'SELECT MAX(position) FROM checkpoints WHERE team_id = ? AND hunt_id = ?',
+            (team_id, hunt_id),
+        ).fetchone()
+        return row[0] if row[0] is not None else -1
+
+    def _record(self, team_id, team_name, sql, params):
+        """Commit one event, creating the team if this is its first"""
+        db = self._db
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            db.execute(
+                'INSERT OR IGNORE INTO teams (team_id, name, created_at) VALUES (?, ?, ?)',
+                (team_id, team_name or default_team_name(team_id), time.time()),
+            )
+            db.execute(sql, params)
+            db.execute('COMMIT')
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            raise
+
+    def record_checkpoint(self, team_id, hunt_id, location_id, position, team_name=None):
+        self._record(
+            team_id, team_name,
+            'INSERT OR IGNORE INTO checkpoints (team_id, hunt_id, location_id, position, reached_at) '
+            'VALUES (?, ?, ?, ?, ?)',
+            (team_id, hunt_id, location_id, position, time.time()),
+        )
+
+    def record_finish(self, team_id, hunt_id, finished_at, team_name=None):
+        self._record(
+            team_id, team_name,
+            'INSERT OR IGNORE INTO finishes (team_id, hunt_id, finished_at) VALUES (?, ?, ?)',
+            (team_id, hunt_id, finished_at),
+        )
+
+    def events_since(self, hunt_id, checkpoint_rowid=0, finish_rowid=0, rename_rowid=0):
+        """Checkpoints, finishes and renames committed after the given rowids, oldest first"""
+        db = self._db
+        checkpoints = db.execute(
+            'SELECT rowid, team_id, location_id, position, reached_at FROM checkpoints '
+            'WHERE hunt_id = ? AND rowid > ? ORDER BY rowid',
+            (hunt_id, checkpoint_rowid),
+        ).fetchall()
+        finishes = db.execute(
+            'SELECT rowid, team_id, finished_at FROM finishes '
+            'WHERE hunt_id = ? AND rowid > ? ORDER BY rowid',
+            (hunt_id, finish_rowid),
+        ).fetchall()
+        renames = db.execute(
+            'SELECT rowid, team_id, name FROM renames WHERE rowid > ? ORDER BY rowid',
+            (rename_rowid,),
+        ).fetchall()
+        return checkpoints, finishes, renames
+
+    def team_names(self, team_ids):
+        """{team_id: name} for the given teams"""
+        team_ids = list(team_ids)
+        names = {}
+        # Stay under SQLite's limit on bound parameters
+        for i in range(0, len(team_ids), 500):
+            chunk = team_ids[i:i + 500]
+            names.update(self._db.execute(
+                f"SELECT team_id, name FROM teams WHERE team_id IN ({', '.join('?' * len(chunk))})", chunk
+            ))
+        return names
+
+    def data_version(self):
+        """Changes whenever anything commits to the database"""
+        # The counter is per connection, so it is always read on the same one; that
+        # connection never writes, so every commit shows up as a change
+        with self._version_lock:
+            if self._version_pid != os.getpid():
+                self._version_db = self._connect()
+                self._version_pid = os.getpid()
+            return self._version_db.execute('PRAGMA data_version').fetchone()[0]
@@ -0,0 +1,140 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import qrcode
+import qrcode.image.svg
+
+import metrics
+
+# Rendered images are also written here so a restarted worker doesn't re-encode them
+QR_CODES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'qr_codes')
+
+MIMETYPES = {
+    'PNG': 'image/png',
+    'SVG': 'image/svg+xml',
+}
+
+
+def render_qr(url, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=10, border=4, fmt='PNG'):
+    """Encode url as a QR code and return the image bytes"""
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=error_correction,
+        box_size=box_size,
+        border=border,
+    )
+    with metrics.phase('qr_encode'):
+        qr.add_data(url)
+        qr.make(fit=True)
+        if fmt == 'SVG':
+            img = qr.make_image(image_factory=qrcode.image.svg.SvgPathImage)
+        else:
+            img = qr.make_image(fill_color="black", back_color="white")
+
+    buffer = BytesIO()
+    with metrics.phase(f'{fmt.lower()}_save'):
+        if fmt == 'SVG':
+            img.save(buffer)
+        else:
+            img.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+class QRCache:
+    """LRU cache of rendered QR images keyed by everything that affects the output.
+
+    Entries are (data, etag) tuples. The key digest doubles as the on-disk file
+    name, so a file on disk is only ever reused for the exact same inputs.
+    """
+
+    def __init__(self, directory=QR_CODES_DIR, max_entries=256):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._fingerprint = None
+
+    @staticmethod
+    def key_digest(url, error_correction, box_size, border, fmt):
+        key = f"{url}\0{error_correction}\0{box_size}\0{border}\0{fmt}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _path(self, digest, fmt):
+        return os.path.join(self.directory, f"qr-{digest}.{fmt.lower()}")
+
+    def get(self, url, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=10, border=4, fmt='PNG'):
+        """Return (data, etag) for the QR image, rendering it at most once"""
+        entry = self.peek(url, error_correction, box_size, border, fmt)
+        if entry is None:
+            data = render_qr(url, error_correction, box_size, border, fmt.upper())
+            entry = self.put(url, data, error_correction, box_size, border, fmt)
+        return entry
+
+    def peek(self, url, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=10, border=4, fmt='PNG'):
+        """Return (data, etag) if the image is in memory or on disk, else None"""
+        fmt = fmt.upper()
+        digest = self.key_digest(url, error_correction, box_size, border, fmt)
+
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+                return entry
+
+        data = self._load(digest, fmt)
+        if data is None:
+            return None
+        return self._remember(digest, data)
+
+    def put(self, url, data, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=10, border=4, fmt='PNG'):
+        """Add an image rendered elsewhere (e.g. by the export pool) and return (data, etag)"""
+        fmt = fmt.upper()
+        digest = self.key_digest(url, error_correction, box_size, border, fmt)
+        self._store(digest, fmt, data)
+        return self._remember(digest, data)
+
+    def _remember(self, digest, data):
+        entry = (data, hashlib.sha256(data).hexdigest())
+        with self._lock:
+            self._entries[digest] = entry
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _load(self, digest, fmt):
+        try:
+            with open(self._path(digest, fmt), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _store(self, digest, fmt, data):
+        # Write to a temp file first so other workers never read a partial image
+        path = self._path(digest, fmt)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            # A read-only filesystem just means we keep the image in memory only
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def invalidate(self, fingerprint):
+        """Drop in-memory entries if the set of QR inputs (base url, locations) changed"""
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                self._entries.clear()
+                self._fingerprint = fingerprint
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
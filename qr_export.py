@@ -0,0 +1,168 @@
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import deque
+from contextlib import closing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+import metrics
+from qr_cache import render_qr
+
+EXPORT_FORMATS = ('PNG', 'SVG', 'PDF')
+
+# Below this many images the pool's start-up and IPC cost more than rendering inline
+POOL_THRESHOLD = int(os.environ.get('QR_EXPORT_POOL_THRESHOLD', 16))
+POOL_PROCESSES = int(os.environ.get('QR_EXPORT_PROCESSES', os.cpu_count() or 1))
+# Longest we wait for any one render before giving up on the export
+RENDER_TIMEOUT = float(os.environ.get('QR_EXPORT_TIMEOUT', 60))
+
+# PDF sheets: A4 at 150 dpi, 2 columns x 3 rows of codes
+SHEET_SIZE = (1240, 1754)
+SHEET_COLUMNS = 2
+SHEET_ROWS = 3
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Process pool for QR rendering, created lazily once per gunicorn worker.
+
+    The worker is multi-threaded, so its children are started from a clean
+    forkserver process instead of being forked from it: a fork could copy a
+    lock (the metrics registry's, say) that another thread was holding.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pool = ProcessPoolExecutor(max_workers=POOL_PROCESSES, mp_context=multiprocessing.get_context(method))
+        return _pool
+
+
+def discard_pool(pool):
+    """Shut down a pool that stopped responding so the next export starts a fresh one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _render_job(job):
+    name, url, box_size, fmt = job
+    return name, render_qr(url, box_size=box_size, fmt=fmt)
+
+
+class _ZipStream:
+    """Write-only file object zipfile can stream into; drained after every entry"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def render_images(jobs, cache=None, window=None):
+    """Yield (name, data) for each (name, url, box_size, fmt) job as soon as it is rendered.
+
+    Cached images are yielded straight away. The rest go to the process pool,
+    with at most `window` renders in flight so memory stays bounded no matter
+    how many locations are exported. Output order is completion order. If
+    nothing finishes within RENDER_TIMEOUT the export fails instead of hanging.
+    """
+    pending = []
+    for name, url, box_size, fmt in jobs:
+        entry = cache.peek(url, box_size=box_size, fmt=fmt) if cache else None
+        if entry is not None:
+            yield name, entry[0]
+        else:
+            pending.append((name, url, box_size, fmt))
+
+    if len(pending) < POOL_THRESHOLD:
+        for job in pending:
+            name, data = _render_job(job)
+            if cache:
+                cache.put(job[1], data, box_size=job[2], fmt=job[3])
+            yield name, data
+        return
+
+    pool = get_pool()
+    window = window or POOL_PROCESSES * 2
+    jobs_by_name = {job[0]: job for job in pending}
+    queue = deque(pending)
+    in_flight = set()
+    while queue or in_flight:
+        try:
+            while queue and len(in_flight) < window:
+                in_flight.add(pool.submit(_render_job, queue.popleft()))
+            done, in_flight = wait(in_flight, timeout=RENDER_TIMEOUT, return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError(f"No QR code rendered in {RENDER_TIMEOUT:.0f}s")
+            results = [future.result() for future in done]
+        except (TimeoutError, BrokenProcessPool):
+            discard_pool(pool)
+            raise
+        for name, data in results:
+            if cache:
+                _, url, box_size, fmt = jobs_by_name[name]
+                cache.put(url, data, box_size=box_size, fmt=fmt)
+            try:
+                yield name, data
+            except GeneratorExit:
+                # The download was abandoned: don't render the rest into nothing
+                for future in in_flight:
+                    future.cancel()
+                raise
+
+
+def stream_zip(jobs, cache=None):
+    """Yield the bytes of a ZIP archive, one entry at a time, as images finish rendering"""
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w') as zip_file, closing(render_images(jobs, cache)) as images:
+        for name, data in images:
+            with metrics.phase('zip_write'):
+                zip_file.writestr(name, data)
+            yield stream.drain()
+    yield stream.drain()
+
+
+def build_pdf_sheet(jobs, labels, cache=None):
+    """Lay the PNG codes out on printable A4 pages and return the PDF bytes"""
+    width, height = SHEET_SIZE
+    cell_w, cell_h = width // SHEET_COLUMNS, height // SHEET_ROWS
+    per_page = SHEET_COLUMNS * SHEET_ROWS
+
+    rendered = dict(render_images(jobs, cache))
+    pages = []
+    for index, (name, *_) in enumerate(jobs):
+        if index % per_page == 0:
+            pages.append(Image.new('1', SHEET_SIZE, 1))
+            draw = ImageDraw.Draw(pages[-1])
+        img = Image.open(BytesIO(rendered.pop(name))).convert('1')
+        img.thumbnail((cell_w - 40, cell_h - 60))
+        slot = index % per_page
+        x = (slot % SHEET_COLUMNS) * cell_w + (cell_w - img.width) // 2
+        y = (slot // SHEET_COLUMNS) * cell_h + 20
+        pages[-1].paste(img, (x, y))
+        draw.text((x, y + img.height + 10), labels[name], fill=0)
+
+    buffer = BytesIO()
+    if pages:
+        pages[0].save(buffer, format='PDF', save_all=True, append_images=pages[1:], resolution=150)
+    return buffer.getvalue()
@@ -0,0 +1,144 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_DB = os.environ.get(
+    'RATE_LIMIT_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ratelimit.db')
+)
+
+# "<guesses>/<seconds>": bucket size, refilled at that rate. Override with RATE_LIMIT_<NAME>.
+DEFAULT_POLICIES = {
+    # One team guessing one location
+    'team': '10/60',
+    # One address guessing one location; generous because campus wifi shares addresses
+    'ip': '60/60',
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL,
+    allowed INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS blocked (
+    policy TEXT NOT NULL,
+    location_id TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (policy, location_id)
+) WITHOUT ROWID;
+'''
+
+# Refill the bucket for the time since it was last used, then take a token if there is one.
+# :capacity and :rate are the policy's bucket size and tokens per second.
+TAKE_TOKEN = '''
+INSERT INTO buckets (key, tokens, updated, allowed) VALUES (:key, :capacity - 1, :now, 1)
+ON CONFLICT(key) DO UPDATE SET
+    allowed = MIN(:capacity, tokens + (:now - updated) * :rate) >= 1,
+    tokens = MIN(:capacity, tokens + (:now - updated) * :rate)
+             - (MIN(:capacity, tokens + (:now - updated) * :rate) >= 1),
+    updated = :now
+RETURNING allowed, tokens
+'''
+
+
+def parse_policy(spec):
+    """'10/60' -> (capacity 10, 10/60 tokens per second)"""
+    guesses, seconds = spec.split('/')
+    capacity = float(guesses)
+    return capacity, capacity / float(seconds)
+
+
+class RateLimiter:
+    """Token buckets for answer guesses, shared by every gunicorn worker through SQLite.
+
+    Each guess takes a token from every bucket that applies to it (the team's
+    and the address's). There is deliberately no bucket shared by everyone
+    guessing a location: a few addresses could drain it and lock every team
+    out of that checkpoint. The refill and take happen in a
+    single UPSERT per bucket, so concurrent workers never race on a bucket.
+    A guess refused by any bucket takes no tokens from the others.
+    Blocked guesses are counted per policy and location.
+    """
+
+    def __init__(self, path=RATE_LIMIT_DB):
+        self.path = path
+        self.enabled = os.environ.get('RATE_LIMIT', 'on') != 'off'
+        self.policies = {
+            name: parse_policy(os.environ.get(f'RATE_LIMIT_{name.upper()}', spec))
+            for name, spec in DEFAULT_POLICIES.items()
+        }
+        self._local = threading.local()
+        db = self._connect()
+        db.executescript(SCHEMA)
+        db.close()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        # Losing the last few buckets in a power cut is harmless
+        db.execute('PRAGMA synchronous=OFF')
+        return db
+
+    @property
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = self._local.db = self._connect()
+            self._local.pid = os.getpid()
+        return db
+
+    def hit(self, location_id, team_id, ip):
+        """Take a token for one guess; returns seconds to wait if blocked, else 0.
+
+        team_id is None for a client without a team, which is limited by address only.
+        """
+        if not self.enabled:
+            return 0
+        subjects = {'team': team_id, 'ip': ip}
+        now = time.time()
+        blocked_by = []
+        retry_after = 0
+        db = self._db
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            db.execute('SAVEPOINT take')
+            for name, (capacity, rate) in self.policies.items():
+                if subjects[name] is None:
+                    continue
+                allowed, tokens = db.execute(TAKE_TOKEN, {
+                    'key': f"{name}:{subjects[name]}:{location_id}",
+                    'capacity': capacity, 'rate': rate, 'now': now,
+                }).fetchone()
+                if not allowed:
+                    blocked_by.append(name)
+                    retry_after = max(retry_after, (1 - tokens) / rate)
+            if blocked_by:
+                # A refused guess costs nothing, so a team hammering away doesn't drain its address's bucket
+                db.execute('ROLLBACK TO take')
+            for name in blocked_by:
+                db.execute(
+                    'INSERT INTO blocked (policy, location_id, count) VALUES (?, ?, 1) '
+                    'ON CONFLICT DO UPDATE SET count = count + 1',
+                    (name, location_id),
+                )
+            db.execute('COMMIT')
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            # Never lock players out because the limiter itself failed
+            logger.exception("Rate limiter failed, allowing guess")
+            return 0
+
+        if blocked_by:
+            logger.info("Blocked guess at %s by %s (%s, team %s)", location_id, ', '.join(blocked_by), ip, team_id)
+        return retry_after
+
+    def blocked_counts(self):
+        """{(policy, location_id): blocked guesses} across all workers"""
+        rows = self._db.execute('SELECT policy, location_id, count FROM blocked')
+        return {(policy, location_id): count for policy, location_id, count in rows}
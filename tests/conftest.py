@@ -0,0 +1,69 @@
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# The app's modules live at the top of the repo, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the app's databases and metrics out of the working tree. Set before any
+# test module is collected, since the modules read these paths at import.
+_tmp = tempfile.mkdtemp(prefix='hunt-tests-')
+atexit.register(shutil.rmtree, _tmp, ignore_errors=True)
+os.environ.update(
+    PROGRESS_DB=os.path.join(_tmp, 'progress.db'),
+    RATE_LIMIT_DB=os.path.join(_tmp, 'ratelimit.db'),
+    METRICS_DIR=os.path.join(_tmp, 'metrics'),
+    METRICS='off',
+    SECRET_KEY='test',
+)
+
+
+@pytest.fixture
+def hunt_app(tmp_path, monkeypatch):
+    """The app module, with fresh caches so tests don't see each other's pages and images"""
+    import app as hunt_app
+    from page_cache import PageCache
+    from qr_cache import QRCache
+
+    monkeypatch.setattr(hunt_app, 'qr_cache', QRCache(str(tmp_path / 'qr_codes')))
+    monkeypatch.setattr(hunt_app, 'page_cache', PageCache(extra_files=[hunt_app.assets.MANIFEST]))
+    # Every test client guesses from 127.0.0.1; tests of the limits install their own limiter
+    monkeypatch.setattr(hunt_app.rate_limiter, 'enabled', False)
+    return hunt_app
+
+
+@pytest.fixture
+def client(hunt_app):
+    """A test client with its own cookie jar, i.e. a new team"""
+    return hunt_app.app.test_client()
+
+
+@pytest.fixture
+def edit_hunt(hunt_app, tmp_path, monkeypatch):
+    """Serve a copy of the hunt from a registry that rechecks on every request.
+
+    Returns a function that takes a callback editing the hunt's data in place
+    and writes the result back, so the next request reloads it.
+    """
+    from hunt import HUNTS_DIR, HuntRegistry
+
+    directory = tmp_path / 'hunts'
+    directory.mkdir()
+    path = directory / f'{hunt_app.HUNT_ID}.json'
+    shutil.copy(os.path.join(HUNTS_DIR, path.name), path)
+    monkeypatch.setattr(hunt_app, 'hunts', HuntRegistry(str(directory), check_interval=0))
+
+    def edit(change):
+        data = json.loads(path.read_text())
+        change(data)
+        path.write_text(json.dumps(data))
+        # Make sure the change is seen even on filesystems with coarse mtimes
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    return edit
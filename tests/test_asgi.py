@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import asgi
+import qr_export
+
+
+def http_scope(headers=()):
+    return {
+        'type': 'http', 'method': 'GET', 'path': '/admin/download', 'query_string': b'',
+        'http_version': '1.1', 'headers': list(headers), 'client': ('10.0.0.1', 5000),
+    }
+
+
+def test_repeated_headers_are_joined():
+    environ = asgi.build_environ(http_scope([
+        (b'cookie', b'session=abc'), (b'cookie', b'theme=dark'),
+        (b'accept', b'text/html'), (b'accept', b'*/*'),
+    ]), b'')
+    assert environ['HTTP_COOKIE'] == 'session=abc; theme=dark'
+    assert environ['HTTP_ACCEPT'] == 'text/html,*/*'
+
+
+def test_body_stops_being_pulled_when_the_client_disconnects(monkeypatch):
+    pulled = []
+    closed = threading.Event()
+
+    def endless_download():
+        try:
+            while True:
+                pulled.append(1)
+                yield b'x' * 1024
+        finally:
+            closed.set()
+
+    def wsgi_app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'application/zip')])
+        return endless_download()
+
+    monkeypatch.setattr(asgi, 'app', wsgi_app)
+
+    async def run():
+        gone = asyncio.Event()
+        sent = []
+
+        async def receive():
+            if not sent:
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await gone.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if len(sent) == 5:
+                gone.set()
+
+        await asyncio.wait_for(asgi.run_wsgi(http_scope(), receive, send), timeout=5)
+        return sent
+
+    sent = asyncio.run(run())
+    assert closed.is_set()
+    assert len(pulled) < 10
+    assert not any(message.get('more_body') is False for message in sent)
+
+
+def test_abandoned_export_cancels_queued_renders(monkeypatch):
+    pool = ThreadPoolExecutor(1)
+    submitted = []
+
+    def submit(*args):
+        future = ThreadPoolExecutor.submit(pool, *args)
+        submitted.append(future)
+        return future
+
+    monkeypatch.setattr(pool, 'submit', submit)
+    monkeypatch.setattr(qr_export, 'get_pool', lambda: pool)
+    monkeypatch.setattr(qr_export, 'POOL_THRESHOLD', 0)
+    # The first image renders at once, the rest only once the download has been dropped
+    released = threading.Event()
+
+    def render(job):
+        if job[0] != '0.png':
+            released.wait(5)
+        return job[0], b'png'
+
+    monkeypatch.setattr(qr_export, '_render_job', render)
+
+    jobs = [(f'{i}.png', f'https://example.org/{i}', 10, 'PNG') for i in range(50)]
+    archive = qr_export.stream_zip(jobs)
+    next(archive)
+    archive.close()
+    released.set()
+    pool.shutdown(wait=True)
+
+    assert len(submitted) < len(jobs)
+    assert any(future.cancelled() for future in submitted)
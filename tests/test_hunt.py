@@ -0,0 +1,72 @@
+import pytest
+
+from hunt import Hunt, normalize_answer
+
+
+@pytest.mark.parametrize('answer, expected', [
+    ('sac', 'sac'),
+    ('  SAC ', 'sac'),
+    ('S.A.C.', 'sac'),
+    ("O'Neil", 'oneil'),
+    ('Bus-Stand!', 'bus stand'),
+    ('bus/stand', 'bus stand'),
+    ('bus   stand', 'bus stand'),
+    ('Café', 'cafe'),
+    ('６９', '69'),
+])
+def test_normalize_answer(answer, expected):
+    assert normalize_answer(answer) == expected
+
+
+def make_hunt(**overrides):
+    data = {
+        'id': 'test',
+        'final_answer': '69',
+        'final_aliases': ['sixty nine'],
+        'locations': {
+            'A': {'name': 'Start', 'riddle': 'r', 'password': 'start', 'next_location': 'B'},
+            'B': {'name': 'Stage', 'riddle': 'r', 'password': 'S.A.C.', 'aliases': ['stage'], 'next_location': None},
+        },
+    }
+    data.update(overrides)
+    return Hunt(data)
+
+
+def test_passwords_and_aliases_match_after_normalizing():
+    location = make_hunt().get('B')
+    assert location.check('sac')
+    assert location.check('Stage!')
+    assert not location.check('start')
+
+
+def test_final_answer():
+    hunt = make_hunt()
+    assert hunt.check_final(' 69 ')
+    assert hunt.check_final('Sixty-Nine')
+    assert not hunt.check_final('96')
+
+
+def test_order_follows_the_next_location_chain():
+    hunt = make_hunt()
+    assert hunt.order == ('A', 'B')
+    assert hunt.get('B').is_final and not hunt.get('A').is_final
+
+
+def test_unreachable_locations_are_rejected():
+    with pytest.raises(ValueError):
+        make_hunt(locations={
+            'A': {'name': 'Start', 'riddle': 'r', 'password': 'start', 'next_location': None},
+            'B': {'name': 'Lost', 'riddle': 'r', 'password': 'x', 'next_location': None},
+        })
+
+
+def test_landing_page_links_to_the_hunts_start(client, edit_hunt):
+    assert b'/location/A"' in client.get('/').data
+
+    def start_elsewhere(data):
+        data['start'] = 'S'
+        data['locations']['S'] = data['locations'].pop('A')
+
+    edit_hunt(start_elsewhere)
+    page = client.get('/').data
+    assert b'/location/S"' in page and b'/location/A"' not in page
@@ -0,0 +1,111 @@
+import bisect
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from leaderboard import Leaderboard, LeaderboardFeed, RankedSkipList
+from progress import ProgressStore
+
+
+def test_ranking_order():
+    board = Leaderboard()
+    board.checkpoint('slow', 'A', 0, 10.0)
+    board.checkpoint('ahead', 'B', 1, 30.0)
+    board.checkpoint('fast', 'A', 0, 5.0)
+    board.checkpoint('done', 'B', 1, 20.0)
+    board.finish('done', 40.0)
+
+    assert [team['id'] for team in board.standings()] == ['done', 'ahead', 'fast', 'slow']
+    assert [board.rank(team_id) for team_id in ('done', 'ahead', 'fast', 'slow')] == [1, 2, 3, 4]
+
+
+def test_earlier_finish_ranks_first():
+    board = Leaderboard()
+    for team_id, finished_at in (('second', 20.0), ('first', 10.0)):
+        board.checkpoint(team_id, 'B', 1, 0.0)
+        board.finish(team_id, finished_at)
+    assert [team['id'] for team in board.standings()] == ['first', 'second']
+
+
+def test_stale_checkpoints_are_ignored():
+    board = Leaderboard()
+    board.checkpoint('team', 'B', 1, 10.0)
+    assert board.checkpoint('team', 'A', 0, 20.0) is None
+    assert board.teams['team']['location'] == 'B'
+
+
+def test_rename_keeps_rank():
+    board = Leaderboard()
+    board.checkpoint('a', 'B', 1, 10.0)
+    board.checkpoint('b', 'A', 0, 10.0)
+    row = board.rename('b', 'Rockets')
+    assert row['name'] == 'Rockets' and row['rank'] == 2
+    assert board.rename('b', 'Rockets') is None
+    assert board.rename('unknown', 'x') is None
+
+
+def test_skip_list_matches_a_sorted_list():
+    rng = random.Random(0)
+    ranking, expected = RankedSkipList(seed=0), []
+    for _ in range(5000):
+        if expected and rng.random() < 0.4:
+            key = rng.choice(expected)
+            expected.remove(key)
+            ranking.remove(key)
+        else:
+            key = (rng.randint(0, 3), rng.random())
+            bisect.insort(expected, key)
+            ranking.insert(key)
+        probe = (rng.randint(0, 3), rng.random())
+        assert ranking.rank(probe) == bisect.bisect_left(expected, probe) + 1
+    assert list(ranking) == expected
+    assert len(ranking) == len(expected)
+    for key in expected[::50]:
+        assert ranking.rank(key) == bisect.bisect_left(expected, key) + 1
+
+
+@pytest.fixture
+def feed(tmp_path):
+    # A long poll interval so only the explicit polls below run
+    store = ProgressStore(str(tmp_path / 'progress.db'))
+    return LeaderboardFeed(store, 'hunt', poll_interval=3600)
+
+
+def in_thread(function, *args):
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(function, *args).result()
+
+
+def test_feed_sees_commits_from_every_connection(feed):
+    for i in range(3):
+        feed.store.record_checkpoint(f'team-{i}', 'hunt', 'B', 1)
+    assert len(feed.standings()) == 3
+
+    # Committed and polled on other threads, i.e. other connections than the catch-up used
+    in_thread(feed.store.record_checkpoint, 'team-3', 'hunt', 'B', 1)
+    in_thread(feed.poll)
+    assert len(feed.standings()) == 4
+
+
+def test_new_teams_arrive_with_their_names(feed):
+    feed.standings()
+    feed.store.record_checkpoint('rockets-id', 'hunt', 'B', 1, 'Rockets')
+    feed.store.record_checkpoint('anonymous', 'hunt', 'B', 1)
+    feed.poll()
+    names = {team['id']: team['name'] for team in feed.standings()}
+    assert names == {'rockets-id': 'Rockets', 'anonymous': 'Team anon'}
+
+
+def test_renames_are_picked_up_as_events(feed):
+    subscriber = feed.subscribe()
+    subscriber.get_nowait()
+    feed.store.record_checkpoint('team', 'hunt', 'B', 1)
+    feed.poll()
+    subscriber.get_nowait()
+
+    feed.store.rename_team('team', 'Comets')
+    feed.store.flush()
+    feed.poll()
+    assert '"Comets"' in subscriber.get_nowait()
+    assert feed.standings()[0]['name'] == 'Comets'
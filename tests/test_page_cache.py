@@ -0,0 +1,92 @@
+import gzip
+import os
+
+import pytest
+
+from page_cache import PageCache
+
+
+@pytest.fixture
+def renders(hunt_app, monkeypatch):
+    """Templates rendered by the app during the test"""
+    rendered = []
+    render_template = hunt_app.render_template
+
+    def counting_render_template(name, **context):
+        rendered.append(name)
+        return render_template(name, **context)
+
+    monkeypatch.setattr(hunt_app, 'render_template', counting_render_template)
+    return rendered
+
+
+def test_pages_are_rendered_once_per_variant(client, hunt_app, renders):
+    first = client.get('/location/B')
+    second = hunt_app.app.test_client().get('/location/B')
+    assert first.data == second.data
+    assert renders == ['location.html']
+
+    # Locked with an error is a different variant
+    wrong = client.post('/location/B', data={'password': 'nope'})
+    assert b'Incorrect password' in wrong.data
+    assert b'Incorrect password' not in client.get('/location/B').data
+    assert renders == ['location.html', 'location.html']
+
+
+def test_variants_have_their_own_etags(client):
+    locked = client.get('/location/B')
+    client.post('/location/B', data={'password': 'sac'})
+    unlocked = client.get('/location/B')
+    assert locked.headers['ETag'] != unlocked.headers['ETag']
+
+    assert client.get('/location/B', headers={'If-None-Match': unlocked.headers['ETag']}).status_code == 304
+    assert client.get('/location/B', headers={'If-None-Match': locked.headers['ETag']}).status_code == 200
+
+
+def test_compressed_for_clients_that_accept_it(client):
+    plain = client.get('/location/A')
+    compressed = client.get('/location/A', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(compressed.data) == plain.data
+    assert 'Accept-Encoding' in compressed.headers['Vary']
+
+
+def test_hunt_reload_drops_cached_pages(client, edit_hunt, renders):
+    assert b'Once a spotlight' in client.get('/location/A').data
+
+    def new_riddle(data):
+        data['locations']['A']['riddle'] = 'A brand new riddle'
+
+    edit_hunt(new_riddle)
+    page = client.get('/location/A').data
+    assert b'A brand new riddle' in page and b'Once a spotlight' not in page
+    assert renders == ['location.html', 'location.html']
+
+
+def test_named_teams_get_their_own_index(client, hunt_app):
+    client.post('/team', data={'name': 'Rockets'})
+    assert b'Rockets' in client.get('/').data
+    assert b'Rockets' not in hunt_app.app.test_client().get('/').data
+
+
+def test_template_changes_drop_cached_pages(tmp_path):
+    template = tmp_path / 'page.html'
+    template.write_text('one')
+    manifest = tmp_path / 'manifest.json'
+    cache = PageCache(str(tmp_path), extra_files=[str(manifest)], check_interval=0)
+    version = object()
+
+    def render():
+        return template.read_text()
+
+    assert cache.get('page', version, render).body == b'one'
+    assert cache.get('page', version, lambda: 'not rendered').body == b'one'
+
+    template.write_text('two')
+    stat = template.stat()
+    os.utime(template, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get('page', version, render).body == b'two'
+
+    # A CSS build (the manifest appearing or changing) counts too
+    manifest.write_text('{}')
+    assert cache.get('page', version, lambda: 'rebuilt').body == b'rebuilt'
@@ -0,0 +1,82 @@
+import pytest
+
+PASSWORDS = {'B': 'sac', 'C': 'stage area', 'D': 'outr fine', 'E': 'bus stand'}
+
+
+def riddle(hunt_app, location_id):
+    return str(hunt_app.current_hunt().get(location_id).riddle_html).encode()
+
+
+def solve(client, *location_ids):
+    for location_id in location_ids:
+        response = client.post(f'/location/{location_id}', data={'password': PASSWORDS[location_id]})
+        assert response.status_code == 200
+    return response
+
+
+def team_id(client):
+    with client.session_transaction() as session:
+        return session['team_id']
+
+
+def count_teams(hunt_app):
+    return hunt_app.progress._db.execute('SELECT COUNT(*) FROM teams').fetchone()[0]
+
+
+def test_start_is_unlocked_for_everyone(client, hunt_app):
+    assert riddle(hunt_app, 'A') in client.get('/location/A').data
+
+
+def test_locations_are_locked_until_reached(client, hunt_app):
+    assert riddle(hunt_app, 'C') not in client.get('/location/C').data
+    solve(client, 'B', 'C')
+    assert riddle(hunt_app, 'C') in client.get('/location/C').data
+
+
+def test_locations_must_be_solved_in_order(client, hunt_app):
+    response = client.post('/location/C', data={'password': PASSWORDS['C']})
+    assert b'Solve location B first!' in response.data
+    assert riddle(hunt_app, 'C') not in response.data
+
+    assert riddle(hunt_app, 'B') in solve(client, 'B').data
+    assert riddle(hunt_app, 'C') in solve(client, 'C').data
+
+
+def test_wrong_password(client, hunt_app):
+    response = client.post('/location/B', data={'password': 'nope'})
+    assert b'Incorrect password' in response.data
+    assert riddle(hunt_app, 'B') not in response.data
+
+
+@pytest.mark.parametrize('path, field', [('/submit_final_answer', 'answer'), ('/location/E', 'final_answer')])
+def test_final_answer_needs_the_final_location(client, path, field):
+    solve(client, 'B', 'C', 'D')
+    assert client.post(path, data={field: '69'}).get_json()['message'] == 'Reach the final location first!'
+
+    solve(client, 'E')
+    assert client.post(path, data={field: '96'}).get_json()['status'] == 'error'
+    assert client.post(path, data={field: '69'}).get_json()['status'] == 'success'
+
+
+def test_progress_is_shared_between_clients_of_the_same_team(client, hunt_app):
+    solve(client, 'B')
+    other = hunt_app.app.test_client()
+    with other.session_transaction() as session:
+        session['team_id'] = team_id(client)
+    assert riddle(hunt_app, 'B') in other.get('/location/B').data
+
+
+def test_visitors_who_only_look_are_not_stored(client, hunt_app):
+    before = count_teams(hunt_app)
+    for path in ('/', '/location/A', '/location/B', '/leaderboard'):
+        response = client.get(path)
+        assert 'Set-Cookie' not in response.headers
+    client.post('/location/B', data={'password': 'nope'})
+    assert count_teams(hunt_app) == before
+
+
+def test_team_is_stored_with_its_first_correct_answer(client, hunt_app):
+    client.post('/team', data={'name': 'Rockets'})
+    solve(client, 'B')
+    assert hunt_app.progress.team_names([team_id(client)]) == {team_id(client): 'Rockets'}
+    assert hunt_app.progress.position(team_id(client), hunt_app.HUNT_ID) == 1
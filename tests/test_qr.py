@@ -0,0 +1,42 @@
+def test_qr_image(client):
+    response = client.get('/qr/A.png')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert response.data.startswith(b'\x89PNG')
+    assert response.headers['ETag']
+
+    svg = client.get('/qr/A.svg')
+    assert svg.mimetype == 'image/svg+xml'
+
+
+def test_unknown_location_or_format(client):
+    assert client.get('/qr/Z.png').status_code == 404
+    assert client.get('/qr/A.gif').status_code == 404
+
+
+def test_revalidation_returns_304(client):
+    etag = client.get('/qr/A.png').headers['ETag']
+    response = client.get('/qr/A.png', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+    assert client.get('/qr/B.png', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_images_are_rendered_once(client, hunt_app, monkeypatch):
+    client.get('/qr/A.png')
+    monkeypatch.setattr(hunt_app.qr_cache, '_load', lambda digest, fmt: None)
+    calls = []
+    monkeypatch.setattr('qr_cache.render_qr', lambda *args: calls.append(args))
+    client.get('/qr/A.png')
+    assert calls == []
+
+
+def test_base_url_change_invalidates_cached_images(client, hunt_app, monkeypatch):
+    old = client.get('/qr/A.png')
+    monkeypatch.setattr(hunt_app, 'BASE_URL', 'https://example.org/')
+    new = client.get('/qr/A.png')
+    assert new.headers['ETag'] != old.headers['ETag']
+    assert client.get('/qr/A.png', headers={'If-None-Match': old.headers['ETag']}).status_code == 200
+    # Only the image for the new URL is still held in memory
+    assert len(hunt_app.qr_cache._entries) == 1
@@ -0,0 +1,159 @@
+import sqlite3
+
+import pytest
+
+import ratelimit
+from ratelimit import RateLimiter, parse_policy
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def limiter(tmp_path, monkeypatch):
+    monkeypatch.delenv('RATE_LIMIT', raising=False)
+    limiter = RateLimiter(str(tmp_path / 'ratelimit.db'))
+    # 2 guesses, refilled at one every 5 seconds
+    limiter.policies = {'team': parse_policy('2/10')}
+    return limiter
+
+
+def test_parse_policy():
+    assert parse_policy('10/60') == (10.0, 10 / 60)
+
+
+def test_allows_a_full_bucket_then_blocks(limiter, clock):
+    assert limiter.hit('B', 'team-1', '10.0.0.1') == 0
+    assert limiter.hit('B', 'team-1', '10.0.0.1') == 0
+    assert limiter.hit('B', 'team-1', '10.0.0.1') == pytest.approx(5.0)
+
+
+def test_refills_at_the_policy_rate(limiter, clock):
+    limiter.hit('B', 'team-1', '10.0.0.1')
+    limiter.hit('B', 'team-1', '10.0.0.1')
+
+    clock.now += 2.5
+    # Half a token has come back; the rest takes another 2.5s
+    assert limiter.hit('B', 'team-1', '10.0.0.1') == pytest.approx(2.5)
+
+    clock.now += 2.5
+    assert limiter.hit('B', 'team-1', '10.0.0.1') == 0
+    assert limiter.hit('B', 'team-1', '10.0.0.1') == pytest.approx(5.0)
+
+
+def test_refill_is_capped_at_the_bucket_size(limiter, clock):
+    limiter.hit('B', 'team-1', '10.0.0.1')
+    clock.now += 3600
+    assert limiter.hit('B', 'team-1', '10.0.0.1') == 0
+    assert limiter.hit('B', 'team-1', '10.0.0.1') == 0
+    assert limiter.hit('B', 'team-1', '10.0.0.1') > 0
+
+
+def test_buckets_are_per_team_and_location(limiter, clock):
+    for _ in range(2):
+        limiter.hit('B', 'team-1', '10.0.0.1')
+    assert limiter.hit('B', 'team-1', '10.0.0.1') > 0
+    assert limiter.hit('C', 'team-1', '10.0.0.1') == 0
+    assert limiter.hit('B', 'team-2', '10.0.0.1') == 0
+
+
+def test_refused_guesses_take_no_tokens(limiter, clock):
+    limiter.policies = {'team': parse_policy('1/10'), 'ip': parse_policy('3/10')}
+    assert limiter.hit('B', 'team-1', '10.0.0.1') == 0
+    assert limiter.hit('B', 'team-1', '10.0.0.1') > 0
+    assert limiter.hit('B', 'team-1', '10.0.0.1') > 0
+    # Only team-1's first guess came out of the address's bucket
+    assert limiter.hit('B', 'team-2', '10.0.0.1') == 0
+    assert limiter.hit('B', 'team-3', '10.0.0.1') == 0
+    assert limiter.hit('B', 'team-4', '10.0.0.1') > 0
+
+
+def test_clients_without_a_team_are_limited_by_address(limiter, clock):
+    limiter.policies = {'team': parse_policy('1/10'), 'ip': parse_policy('2/10')}
+    assert limiter.hit('B', None, '10.0.0.1') == 0
+    assert limiter.hit('B', None, '10.0.0.1') == 0
+    assert limiter.hit('B', None, '10.0.0.1') > 0
+    assert limiter.blocked_counts() == {('ip', 'B'): 1}
+
+
+def test_blocked_guesses_are_counted(limiter, clock):
+    for _ in range(4):
+        limiter.hit('B', 'team-1', '10.0.0.1')
+    assert limiter.blocked_counts() == {('team', 'B'): 2}
+
+
+def test_fails_open_when_the_database_errors(limiter, clock, monkeypatch):
+    class BrokenDatabase:
+        in_transaction = False
+
+        def execute(self, *args):
+            raise sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(RateLimiter, '_db', property(lambda self: BrokenDatabase()))
+    assert limiter.hit('B', 'team-1', '10.0.0.1') == 0
+
+
+def test_disabled(limiter, clock):
+    limiter.enabled = False
+    for _ in range(5):
+        assert limiter.hit('B', 'team-1', '10.0.0.1') == 0
+
+
+@pytest.fixture
+def route_limiter(hunt_app, tmp_path, monkeypatch):
+    limiter = RateLimiter(str(tmp_path / 'route-ratelimit.db'))
+    limiter.policies = {'team': parse_policy('3/60'), 'ip': parse_policy('5/60')}
+    monkeypatch.setattr(hunt_app, 'rate_limiter', limiter)
+    return limiter
+
+
+def guess(client, address='10.0.0.1', path='/location/B', **form):
+    return client.post(path, data=form or {'password': 'wrong'}, headers={'X-Forwarded-For': address})
+
+
+def test_team_guesses_are_limited(hunt_app, route_limiter):
+    client = hunt_app.app.test_client()
+    client.post('/team', data={'name': 'Rockets'})
+    assert [guess(client).status_code for _ in range(4)] == [200, 200, 200, 429]
+    assert int(guess(client).headers['Retry-After']) > 0
+    # Another team behind the same address still has guesses left
+    other = hunt_app.app.test_client()
+    other.post('/team', data={'name': 'Comets'})
+    assert guess(other).status_code == 200
+
+
+def test_dropping_the_cookie_does_not_reset_the_limit(hunt_app, route_limiter):
+    client = hunt_app.app.test_client(use_cookies=False)
+    assert [guess(client).status_code for _ in range(6)] == [200] * 5 + [429]
+
+
+def test_addresses_come_from_the_proxy(hunt_app, route_limiter):
+    client = hunt_app.app.test_client(use_cookies=False)
+    for _ in range(5):
+        guess(client, '10.0.0.1')
+    assert guess(client, '10.0.0.1').status_code == 429
+    assert guess(client, '10.0.0.2').status_code == 200
+
+
+def test_final_answer_routes_share_one_budget(hunt_app, route_limiter):
+    client = hunt_app.app.test_client()
+    client.post('/team', data={'name': 'Rockets'})
+    codes = [
+        guess(client, path='/submit_final_answer', answer='1').status_code,
+        guess(client, path='/location/E', final_answer='1').status_code,
+        guess(client, path='/submit_final_answer', answer='1').status_code,
+        guess(client, path='/location/E', final_answer='1').status_code,
+    ]
+    assert codes == [200, 200, 200, 429]